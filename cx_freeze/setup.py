@@ -18,7 +18,6 @@ build_exe_options = {
         "lxml",
         "simplemma",
         "bidict",
-        "pystardict",
         "flask",
         "pymorphy2",
         "flask_sqlalchemy",
@@ -1,7 +1,11 @@
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context
 from PyQt5.QtCore import *
 from .dictionary import *
-from .db import Record
+from .db import LOOKUP_COLUMNS
+from itertools import chain
+import csv
+import io
+import json
 import logging
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
@@ -11,6 +15,34 @@ def str2bool(v):
     return str(v).lower() in ("yes", "true", "t", "1")
 
 
+def textLines(rows):
+    for i, row in enumerate(rows):
+        yield ("\n" if i else "") + " ".join(str(item) for item in row)
+
+
+def ndjsonLines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(LOOKUP_COLUMNS, row)), ensure_ascii=False) + "\n"
+
+
+def csvLines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chain([LOOKUP_COLUMNS], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# format: (serializer, media type) of the formats /logs can be streamed in
+log_formats = {
+    "text": (textLines, "text/plain"),
+    "ndjson": (ndjsonLines, "application/x-ndjson"),
+    "csv": (csvLines, "text/csv"),
+}
+
+
 class LanguageServer(QObject):
     note_signal = pyqtSignal(str, str, str, list)
 
@@ -64,19 +96,51 @@ class LanguageServer(QObject):
 
         @self.app.route("/stats")
         def stats():
-            rec = Record()
+            rec = self.parent.rec
             return str(
                 f"Today: {rec.countLookupsToday()} lookups, {rec.countNotesToday()} notes")
 
+        @self.app.route("/search/<string:query>")
+        def search(query):
+            lang = self.settings.value("target_language")
+            name = request.args.get("dict") or self.settings.value("dict_source")
+            limit = request.args.get("limit", SEARCH_LIMIT, type=int)
+            return {
+                "results": [
+                    {"word": word, "snippet": snippet}
+                    for word, snippet in dictdb.search(query, lang, name, limit)
+                ]
+            }
+
+        @self.app.route("/complete/<string:prefix>")
+        def complete_prefix(prefix):
+            return {
+                "completions": complete(
+                    prefix,
+                    self.settings.value("target_language"),
+                    self.settings.value("dict_source"),
+                    self.settings.value("freq_source", "<disabled>"),
+                    request.args.get("limit", COMPLETE_LIMIT, type=int))
+            }
+
         @self.app.route("/lemmatize/<string:word>")
         def lemmatize(word):
             return lem_word(word, self.settings.value("target_language"))
 
         @self.app.route("/logs")
         def logs():
-            rec = Record()
-            return "\n".join([" ".join([str(i) for i in item])
-                             for item in rec.getAllLookups()][::-1])
+            serialize, mimetype = log_formats.get(
+                request.args.get("format"), log_formats["text"])
+            lookups = self.parent.rec.iterLookups(
+                before=request.args.get("before", type=float),
+                start=request.args.get("start", type=float),
+                end=request.args.get("end", type=float),
+                language=request.args.get("language"),
+                source=request.args.get("source"),
+                success=request.args.get("success", type=str2bool),
+                limit=request.args.get("limit", type=int))
+            # Written out as the rows are read
+            return Response(stream_with_context(serialize(lookups)), mimetype=mimetype)
 
         try:
             self.app.run(
@@ -0,0 +1,171 @@
+"""
+Compiled dictionaries: a single read-only file that is memory-mapped and
+looked up without parsing anything at open time.
+
+Layout (all integers are unsigned 64-bit, native byte order):
+    header          magic, entry count, then the file offsets of each part
+    headwords       the UTF-8 lookup key of each headword, then the
+                    headword itself, each terminated by a NUL byte,
+                    sorted by key and then by headword
+    word offsets    position of each key within the headwords part
+    blocks          zlib-compressed blocks of BLOCK_ENTRIES definitions
+    block offsets   file offset of each block, plus the end of the last one
+
+A decompressed block starts with BLOCK_ENTRIES + 1 32-bit positions of
+its definitions, followed by the definitions themselves.
+"""
+import os
+import struct
+import tempfile
+import zlib
+from array import array
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+from .mount import mapfile
+
+MAGIC = b"VSDICT2\0"
+HEADER = struct.Struct("=8sQQQQQQ")
+# Definitions compressed together. Larger blocks compress better, smaller
+# ones are quicker to inflate on each lookup.
+BLOCK_ENTRIES = 32
+# Number of inflated blocks kept in memory per dictionary
+BLOCK_CACHE_SIZE = 64
+
+
+def pad(f):
+    "Align the next write to 8 bytes, so that arrays can be mapped directly"
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+def writeCompiled(entries: Iterable[Tuple[str, str]], outpath, normalize: Callable[[str], str],
+                  progress=None) -> int:
+    """
+    Compile (headword, definition) pairs into a dictionary file, where
+    headwords are looked up by their normalize() key.
+    Definitions are spilled to a temporary file while the headwords are
+    sorted, so only the headwords are ever held in memory.
+    If a headword occurs more than once, the last definition wins.
+    """
+    with tempfile.TemporaryFile() as spill:
+        records = {}
+        pos = 0
+        for headword, definition in entries:
+            data = definition.encode("utf-8")
+            spill.write(data)
+            records[headword.encode("utf-8")] = (pos, len(data))
+            pos += len(data)
+            if progress is not None and len(records) % 10000 == 0:
+                progress(len(records))
+        keys = {word: normalize(word.decode("utf-8")).encode("utf-8") for word in records}
+        words = sorted(records, key=lambda word: (keys[word], word))
+
+        with open(outpath + ".tmp", "wb") as f:
+            f.write(b"\0" * HEADER.size)
+            words_start = f.tell()
+            wordoffsets = array("Q")
+            for word in words:
+                wordoffsets.append(f.tell() - words_start)
+                f.write(keys[word] + b"\0" + word + b"\0")
+            pad(f)
+            wordoffsets_start = f.tell()
+            f.write(wordoffsets.tobytes())
+
+            blockoffsets = array("Q")
+            for i in range(0, len(words), BLOCK_ENTRIES):
+                positions = array("I", [0])
+                definitions = []
+                for word in words[i:i + BLOCK_ENTRIES]:
+                    offset, size = records[word]
+                    spill.seek(offset)
+                    definitions.append(spill.read(size))
+                    positions.append(positions[-1] + size)
+                positions.extend([positions[-1]] * (BLOCK_ENTRIES + 1 - len(positions)))
+                blockoffsets.append(f.tell())
+                f.write(zlib.compress(positions.tobytes() + b"".join(definitions)))
+            blockoffsets.append(f.tell())
+            pad(f)
+            blockoffsets_start = f.tell()
+            f.write(blockoffsets.tobytes())
+
+            f.seek(0)
+            f.write(HEADER.pack(
+                MAGIC, len(words), words_start, wordoffsets_start,
+                len(blockoffsets) - 1, blockoffsets_start, BLOCK_ENTRIES))
+    os.replace(outpath + ".tmp", outpath)
+    return len(words)
+
+
+class CompiledDictionary():
+    def __init__(self, path):
+        self.data = mapfile(path)
+        (magic, self.count, self.words_start, wordoffsets_start,
+         nblocks, blockoffsets_start, self.per_block) = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled dictionary")
+        view = memoryview(self.data)
+        self.wordoffsets = view[wordoffsets_start:wordoffsets_start + 8 * self.count].cast("Q")
+        self.blockoffsets = view[blockoffsets_start:blockoffsets_start + 8 * (nblocks + 1)].cast("Q")
+        self.cache = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def key(self, i: int) -> bytes:
+        start = self.words_start + self.wordoffsets[i]
+        return self.data[start:self.data.find(b"\0", start)]
+
+    def word(self, i: int) -> bytes:
+        start = self.data.find(b"\0", self.words_start + self.wordoffsets[i]) + 1
+        return self.data[start:self.data.find(b"\0", start)]
+
+    def block(self, b: int) -> bytes:
+        if (res := self.cache.get(b)) is None:
+            if len(self.cache) >= BLOCK_CACHE_SIZE:
+                self.cache.clear()
+            res = self.cache[b] = zlib.decompress(
+                self.data[self.blockoffsets[b]:self.blockoffsets[b + 1]])
+        return res
+
+    def lowerBound(self, target: bytes) -> int:
+        "Position of the first headword whose key is not less than target"
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, word: str, key: str) -> int:
+        """
+        Position of the headword with the given key, preferring the one
+        spelled exactly like word, or -1
+        """
+        target = key.encode("utf-8")
+        exact = word.encode("utf-8")
+        first = i = self.lowerBound(target)
+        while i < self.count and self.key(i) == target:
+            if self.word(i) == exact:
+                return i
+            i += 1
+        return first if first < i else -1
+
+    def wordsFrom(self, prefix: str) -> Iterator[str]:
+        "Iterate over the headwords whose key starts with prefix, in order"
+        target = prefix.encode("utf-8")
+        i = self.lowerBound(target)
+        while i < self.count and self.key(i).startswith(target):
+            yield self.word(i).decode("utf-8")
+            i += 1
+
+    def definitionAt(self, i: int) -> str:
+        block = self.block(i // self.per_block)
+        start, end = struct.unpack_from("=LL", block, 4 * (i % self.per_block))
+        header = 4 * (self.per_block + 1)
+        return block[header + start:header + end].decode("utf-8")
+
+    def define(self, word: str, key: str) -> Optional[str]:
+        i = self.find(word, key)
+        if i == -1:
+            return None
+        return self.definitionAt(i)
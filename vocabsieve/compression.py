@@ -0,0 +1,49 @@
+"""
+Compression of individual definitions with a preset ("shared") zlib
+dictionary trained on each dictionary's own entries. Entries are mostly
+short and full of the same markup, which plain per-entry compression
+cannot take advantage of.
+"""
+import re
+import zlib
+from collections import Counter
+from typing import List
+
+# zlib can only look back 32 KiB, so a larger preset dictionary is useless
+ZDICT_SIZE = 32768
+# Number of entries a preset dictionary is trained on
+TRAIN_SAMPLES = 2000
+COMPRESS_LEVEL = 6
+
+# Markup tags, and words with their trailing space
+re_fragment = re.compile(rb"<[^<>]{1,200}>|[^<>\s]{1,64}\s?")
+
+
+def train(samples: List[bytes], size=ZDICT_SIZE) -> bytes:
+    """
+    Build a preset dictionary from the fragments that account for the
+    most bytes across the samples. The most valuable ones are placed last,
+    where they can be referenced with the shortest distances.
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        counts.update(re_fragment.findall(sample))
+    chosen = []
+    total = 0
+    for fragment, n in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if n < 2:
+            break
+        if total + len(fragment) <= size:
+            chosen.append(fragment)
+            total += len(fragment)
+    return b"".join(reversed(chosen))
+
+
+def compress(data: bytes, zdict: bytes) -> bytes:
+    c = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    return c.compress(data) + c.flush()
+
+
+def decompress(data: bytes, zdict: bytes) -> bytes:
+    d = zlib.decompressobj(-zlib.MAX_WBITS, zdict=zdict)
+    return d.decompress(data) + d.flush()
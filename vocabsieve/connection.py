@@ -0,0 +1,159 @@
+"""
+Connections to the SQLite databases, shared by the GUI, the API and
+reader servers and the background workers.
+
+Each thread reads through a connection of its own, so that a query in
+one never disturbs the cursor of another, and keeps it, so that its
+statements are only prepared once. Threads that end, such as those the
+servers start for each request, leave their connection to the next one.
+In WAL mode, readers do not block the writer nor the other way round.
+Writes go through a single connection, one transaction at a time. While
+a thread writes, it reads through that connection too, so that it sees
+what it has written.
+"""
+import sqlite3
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+# Prepared statements kept by each connection
+CACHED_STATEMENTS = 256
+
+
+class Lease():
+    "A connection lent to a thread, given back when the thread ends"
+
+    def __init__(self, conn: sqlite3.Connection, idle: deque):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.idle = idle
+
+    def __del__(self):
+        # Runs on thread exit, at any point of another thread's code:
+        # deque.append() needs no lock. A transaction left open, even one
+        # that only read, would pin the database as it was for the next
+        # thread.
+        try:
+            self.conn.rollback()
+        except sqlite3.Error:
+            # Closed by Database.close()
+            return
+        self.idle.append(self.conn)
+
+
+class Database():
+    def __init__(self, filepath: str, setup: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.path = filepath
+        # Called on every new connection, to register functions
+        self.setup = setup
+        self.local = threading.local()
+        self.idle: deque = deque()
+        self.leases: "weakref.WeakSet[Lease]" = weakref.WeakSet()
+        # Reentrant, so that writes can be nested
+        self.lock = threading.RLock()
+        self.writer: Optional[sqlite3.Connection] = None
+        self.writercursor: Optional[sqlite3.Cursor] = None
+
+    def open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, this can only lose the last transactions on power
+        # loss, never corrupt the database
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if self.setup is not None:
+            self.setup(conn)
+        return conn
+
+    def lease(self) -> Lease:
+        if (lease := getattr(self.local, "lease", None)) is None:
+            try:
+                conn = self.idle.pop()
+            except IndexError:
+                conn = self.open()
+            lease = self.local.lease = Lease(conn, self.idle)
+            self.leases.add(lease)
+        return lease
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        "Connection of the calling thread, which is the writer while it writes"
+        if getattr(self.local, "writing", False) and self.writer is not None:
+            return self.writer
+        return self.lease().conn
+
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        "Cursor of the calling thread, which is the writer's while it writes"
+        if getattr(self.local, "writing", False) and self.writercursor is not None:
+            return self.writercursor
+        return self.lease().cursor
+
+    @contextmanager
+    def writing(self) -> Iterator[sqlite3.Connection]:
+        """
+        Lend the writer connection to the calling thread, waiting for any
+        other to give it back. Statements that cannot run in a transaction,
+        such as some PRAGMAs and VACUUM, go here; the others in write().
+        """
+        with self.lock:
+            if (writer := self.writer) is None:
+                writer = self.writer = self.open()
+                self.writercursor = writer.cursor()
+            outer = getattr(self.local, "writing", False)
+            self.local.writing = True
+            try:
+                yield writer
+            finally:
+                self.local.writing = outer
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """
+        Run a transaction on the writer connection, waiting for any other.
+        Nested in another, it joins it.
+        """
+        with self.writing() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            # Explicitly, as the sqlite3 module does not start transactions
+            # for CREATE, DROP and the like
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def close(self):
+        "Close every connection. Only for databases no other thread uses."
+        with self.lock:
+            for lease in list(self.leases):
+                lease.conn.close()
+            for conn in self.idle:
+                conn.close()
+            # Leases still around give their connection back to the old one
+            self.idle = deque()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+                self.writercursor = None
+            self.local = threading.local()
+            _databases.pop(self.path, None)
+
+
+# Databases in use, which are dropped once nothing refers to them
+_databases: "weakref.WeakValueDictionary[str, Database]" = weakref.WeakValueDictionary()
+_lock = threading.Lock()
+
+
+def openDatabase(filepath: str, setup: Optional[Callable[[sqlite3.Connection], None]] = None) -> Database:
+    "The connections to the database at filepath, shared by the whole program"
+    with _lock:
+        if (db := _databases.get(filepath)) is None:
+            db = _databases[filepath] = Database(filepath, setup)
+        return db
@@ -1,15 +1,46 @@
 import sqlite3
-from PyQt5.QtCore import QStandardPaths, QCoreApplication
+import os
+from PyQt5.QtCore import QStandardPaths, QCoreApplication, QObject, pyqtSignal
 from os import path
 from pathlib import Path
 import time
 from bidict import bidict
 import pycountry
 import re
+import html
 from datetime import datetime, timedelta
+from itertools import islice, chain
+from bisect import bisect_left
+import heapq
+import threading
+import weakref
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+from .mount import mountDictionary, unmountDictionary, writeatomic
+from .compiled import CompiledDictionary, writeCompiled
+from . import compression
+from .phrases import PhraseMatcher, buildMatcher
+from .segment import Segmenter
+from collections import namedtuple
+from typing import Optional
+from .normalize import normalizeKey
+from .schema import migrate, setVersion
+from .connection import openDatabase
+from . import fuzzy
 datapath = QStandardPaths.writableLocation(QStandardPaths.DataLocation)
 Path(datapath).mkdir(parents=True, exist_ok=True)
 print(datapath)
+# Index files of dictionaries that are looked up in place
+mountpath = path.join(datapath, "mounted")
+Path(mountpath).mkdir(parents=True, exist_ok=True)
+# Dictionaries compiled into read-only files
+compiledpath = path.join(datapath, "compiled")
+Path(compiledpath).mkdir(parents=True, exist_ok=True)
+# Names the file of the dictionary database in use. Rebuilds write a new
+# database, then switch to it by replacing this file.
+dictpointer = path.join(datapath, "dict.current")
+# Dictionary databases, and the files SQLite keeps next to them
+re_dictdb = re.compile(r"(dict(?:-\d+)?\.db)(?:-wal|-shm|-journal)?")
 # Currently, all languages with two letter codes can be set
 langcodes = bidict(
     dict(
@@ -28,20 +59,57 @@ langcodes['haw'] = "Hawaiian"
 langcodes['ceb'] = "Cebuano"
 langcodes['hmn'] = "Hmong"
 
+# Number of entries written per executemany() call during imports
+IMPORT_CHUNK_SIZE = 10000
+# Page cache used while importing, in KiB
+IMPORT_CACHE_KIB = 65536
+# Number of words per query in define_many(), well below SQLite's
+# limit on bound parameters
+DEFINE_CHUNK_SIZE = 500
+# Default number of results of a full-text search
+SEARCH_LIMIT = 50
+# Seconds for which lookups and notes are held to be written together
+RECORD_FLUSH_INTERVAL = 1.0
+# Rows read at a time when going through the history of lookups
+HISTORY_CHUNK_SIZE = 1000
+# Columns of the lookups table, in order
+LOOKUP_COLUMNS = ("timestamp", "word", "definition", "language", "lemmatization", "source", "success")
+
 dictionaries = bidict({"Wiktionary (English)": "wikt-en",
                        "Google Translate": "gtrans"})
 
 
-class Record():
+def dayOf(timestamp: float) -> str:
+    "Local date of a timestamp, as SQLite's date(timestamp, 'unixepoch', 'localtime')"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+
+class Record(QObject):
+    # Emitted from the writer thread once records are written
+    recorded = pyqtSignal()
+
     def __init__(self):
-        self.conn = sqlite3.connect(
-            path.join(
-                datapath,
-                "records.db"),
-            check_same_thread=False)
-        self.c = self.conn.cursor()
-        self.createTables()
-        self.fixOld()
+        super().__init__()
+        self.filepath = path.join(datapath, "records.db")
+        self.db = openDatabase(self.filepath)
+        migrate(self.db, self.migrations())
+        # Rows to be inserted by the writer thread, which is only started
+        # once something is recorded
+        self.queue = Queue()
+        self.writer = None
+        self.lock = threading.Lock()
+
+    @property
+    def conn(self):
+        return self.db.conn
+
+    @property
+    def c(self):
+        return self.db.cursor
+
+    def migrations(self):
+        "Changes to the schema of records.db, in the order they were made"
+        return [self.createTables, self.fixOld, self.addDailyStats]
 
     def createTables(self):
         self.c.execute("""
@@ -69,7 +137,57 @@ class Record():
             tags TEXT
         )
         """)
-        self.conn.commit()
+
+    def addDailyStats(self):
+        self.c.execute("""
+        CREATE INDEX IF NOT EXISTS lookups_timestamp ON lookups(timestamp)
+        """)
+        self.c.execute("""
+        CREATE INDEX IF NOT EXISTS notes_timestamp ON notes(timestamp)
+        """)
+        # Kept up to date as records are written: the number of distinct
+        # words successfully looked up and of notes added each day, and
+        # the words already counted
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            lookups INTEGER NOT NULL DEFAULT 0,
+            notes INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS daily_words (
+            day TEXT,
+            word TEXT,
+            PRIMARY KEY (day, word)
+        ) WITHOUT ROWID
+        """)
+        # Counted from the lookups and notes already recorded
+        self.c.execute("DELETE FROM daily_words")
+        self.c.execute("DELETE FROM daily_stats")
+        self.c.execute("""
+        INSERT OR IGNORE INTO daily_words(day, word)
+        SELECT date(timestamp, 'unixepoch', 'localtime'), word
+        FROM lookups
+        WHERE success = 1
+        """)
+        self.c.execute("""
+        INSERT INTO daily_stats(day, lookups)
+        SELECT day, COUNT(*) FROM daily_words GROUP BY day
+        """)
+        self.c.execute("""
+        SELECT date(timestamp, 'unixepoch', 'localtime') AS day, COUNT(*)
+        FROM notes
+        WHERE success = 1
+        GROUP BY day
+        """)
+        for day, notes in self.c.fetchall():
+            self.c.execute("""
+            INSERT OR IGNORE INTO daily_stats(day) VALUES(?)
+            """, (day,))
+            self.c.execute("""
+            UPDATE daily_stats SET notes = ? WHERE day = ?
+            """, (notes, day))
 
     def fixOld(self):
         """
@@ -86,7 +204,6 @@ class Record():
                 self.c.execute("""
                 UPDATE lookups SET language=? WHERE language=?
                 """, (langcodes.inverse[languagename], languagename))
-                self.conn.commit()
         self.c.execute("""
         SELECT DISTINCT source FROM lookups
         """)
@@ -96,19 +213,72 @@ class Record():
                 self.c.execute("""
                 UPDATE lookups SET source=? WHERE source=?
                 """, (dictionaries.inverse[source], source))
-                self.conn.commit()
-        try:
-            self.c.executescript("""
-                ALTER TABLE notes ADD COLUMN sentence TEXT;
-                ALTER TABLE notes ADD COLUMN word TEXT;
-                ALTER TABLE notes ADD COLUMN definition TEXT;
-                ALTER TABLE notes ADD COLUMN definition2 TEXT;
-                ALTER TABLE notes ADD COLUMN pronunciation TEXT;
-                ALTER TABLE notes ADD COLUMN image TEXT;
-                ALTER TABLE notes ADD COLUMN tags TEXT;
-            """)
-        except sqlite3.OperationalError:
-            pass
+        # One by one, as executescript() would commit the migration halfway
+        for column in ("sentence", "word", "definition", "definition2", "pronunciation",
+                       "image", "tags"):
+            try:
+                self.c.execute(f"ALTER TABLE notes ADD COLUMN {column} TEXT")
+            except sqlite3.OperationalError:
+                pass
+
+    def write(self, save, values):
+        "Queue a row to be saved. Callers never wait for the disk."
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.writeBehind, daemon=True)
+                self.writer.start()
+        self.queue.put((save, values))
+
+    def writeBehind(self):
+        """
+        Insert queued rows in one transaction per RECORD_FLUSH_INTERVAL,
+        so that a burst of lookups costs a single sync. The queue also
+        carries flush requests, as events to set once all rows before
+        them are written, and None to stop.
+        """
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            rows = []
+            flushed = []
+            deadline = time.monotonic() + RECORD_FLUSH_INTERVAL
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                elif isinstance(item, threading.Event):
+                    flushed.append(item)
+                    break
+                rows.append(item)
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except Empty:
+                    break
+            try:
+                with self.db.write() as conn:
+                    for save, values in rows:
+                        save(conn, values)
+                if rows:
+                    self.recorded.emit()
+            except sqlite3.Error as e:
+                print(f"Could not record {len(rows)} lookups and notes: {e}")
+            for event in flushed:
+                event.set()
+
+    def flush(self):
+        "Wait until everything recorded so far is written"
+        if self.writer is not None and self.writer.is_alive():
+            event = threading.Event()
+            self.queue.put(event)
+            event.wait()
+
+    def close(self):
+        "Write what is left and stop the writer thread"
+        with self.lock:
+            if self.writer is not None:
+                self.queue.put(None)
+                self.writer.join()
+                self.writer = None
 
     def recordLookup(
             self,
@@ -118,30 +288,20 @@ class Record():
             lemmatization,
             source,
             success):
-        try:
-            timestamp = time.time()
-            sql = """INSERT INTO lookups(timestamp, word, definition, language, lemmatization, source, success)
-                    VALUES(?,?,?,?,?,?,?)"""
-            self.c.execute(
-                sql,
-                (timestamp,
-                 word,
-                 definition,
-                 language,
-                 lemmatization,
-                 source,
-                 success))
-            self.conn.commit()
-        except sqlite3.ProgrammingError:
-            return
+        timestamp = time.time()
+        self.write(
+            self.saveLookup,
+            (timestamp,
+             word,
+             definition,
+             language,
+             lemmatization,
+             source,
+             success))
 
     def recordNote(self, data, sentence, word, definition, definition2, pronunciation, image, tags, success):
         timestamp = time.time()
-        sql = """INSERT INTO notes(
-            timestamp, data, sentence, word, definition, definition2, pronunciation, image, tags, success
-            ) 
-            VALUES(?,?,?,?,?,?,?,?,?,?)"""
-        self.c.execute(sql, 
+        self.write(self.saveNote,
             (
                 timestamp, 
                 data, 
@@ -155,13 +315,85 @@ class Record():
                 success
             )
         )
-        self.conn.commit()
+
+    @staticmethod
+    def count(conn, day, column):
+        conn.execute("""
+        INSERT OR IGNORE INTO daily_stats(day) VALUES(?)
+        """, (day,))
+        conn.execute(f"""
+        UPDATE daily_stats SET {column} = {column} + 1 WHERE day = ?
+        """, (day,))
+
+    def saveLookup(self, conn, values):
+        conn.execute("""INSERT INTO lookups(timestamp, word, definition, language, lemmatization, source, success)
+                VALUES(?,?,?,?,?,?,?)""", values)
+        timestamp, word, *_, success = values
+        if success:
+            day = dayOf(timestamp)
+            if conn.execute("""
+            INSERT OR IGNORE INTO daily_words(day, word) VALUES(?, ?)
+            """, (day, word)).rowcount:
+                self.count(conn, day, "lookups")
+
+    def saveNote(self, conn, values):
+        conn.execute("""INSERT INTO notes(
+            timestamp, data, sentence, word, definition, definition2, pronunciation, image, tags, success
+            ) 
+            VALUES(?,?,?,?,?,?,?,?,?,?)""", values)
+        if values[-1]:
+            self.count(conn, dayOf(values[0]), "notes")
 
     def getAllLookups(self):
+        self.flush()
         self.c.execute("SELECT * FROM lookups")
         return self.c.fetchall()
 
+    def iterLookups(self, before=None, start=None, end=None, language=None, source=None,
+                    success=None, limit=None):
+        """
+        Iterate over past lookups, newest first, as rows with the columns
+        in LOOKUP_COLUMNS. Only lookups made before the timestamp before,
+        between the timestamps start and end, and with the given language,
+        source and success are included, up to limit of them.
+        Each chunk of rows is read from where the last one ended on the
+        timestamp index, rather than from an offset, so going through the
+        whole history takes constant memory and time per row.
+        """
+        self.flush()
+        conditions = []
+        params = []
+        for condition, value in (("timestamp < ?", before),
+                                 ("timestamp >= ?", start),
+                                 ("timestamp <= ?", end),
+                                 ("language = ?", language),
+                                 ("source = ?", source),
+                                 ("success = ?", success if success is None else int(success))):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        columns = ", ".join(LOOKUP_COLUMNS)
+        # rowid tells apart lookups with the same timestamp
+        last = None
+        while limit is None or limit > 0:
+            size = HISTORY_CHUNK_SIZE if limit is None else min(limit, HISTORY_CHUNK_SIZE)
+            keyset = [] if last is None else ["(timestamp, rowid) < (?, ?)"]
+            rows = self.conn.execute(f"""
+            SELECT rowid, {columns} FROM lookups
+            WHERE {" AND ".join(conditions + keyset) or 1}
+            ORDER BY timestamp DESC, rowid DESC
+            LIMIT ?
+            """, params + list(last or ()) + [size]).fetchall()
+            for row in rows:
+                yield row[1:]
+            if len(rows) < size:
+                return
+            last = (rows[-1][1], rows[-1][0])
+            if limit is not None:
+                limit -= len(rows)
+
     def getAllNotes(self):
+        self.flush()
         self.c.execute("SELECT * FROM notes")
         return self.c.fetchall()
 
@@ -173,125 +405,1116 @@ class Record():
         day = datetime.now()
         return self.countNotesDay(day)
 
-    def countLookupsDay(self, day):
-        start = day.replace(
-            hour=0,
-            minute=0,
-            second=0,
-            microsecond=0).timestamp()
-        end = day.replace(hour=23, minute=59, second=59,
-                          microsecond=999999).timestamp()
+    def countDay(self, day, column):
         try:
-            self.c.execute("""SELECT COUNT (DISTINCT word)
-                            FROM lookups
-                            WHERE timestamp
-                            BETWEEN ? AND ?
-                            AND success = 1 """, (start, end))
-            return self.c.fetchall()[0][0]
+            self.c.execute(f"""SELECT {column}
+                            FROM daily_stats
+                            WHERE day = ?""", (day.strftime("%Y-%m-%d"),))
+            res = self.c.fetchone()
+            return res[0] if res else 0
         except sqlite3.ProgrammingError:
             return
 
+    def countLookupsDay(self, day):
+        "Number of distinct words successfully looked up on day"
+        return self.countDay(day, "lookups")
+
     def countNotesDay(self, day):
-        start = day.replace(
-            hour=0,
-            minute=0,
-            second=0,
-            microsecond=0).timestamp()
-        end = day.replace(hour=23, minute=59, second=59,
-                          microsecond=999999).timestamp()
-        try:
-            self.c.execute("""SELECT COUNT (timestamp)
-                            FROM notes
-                            WHERE timestamp
-                            BETWEEN ? AND ?
-                            AND success = 1 """, (start, end))
-            return self.c.fetchall()[0][0]
-        except sqlite3.ProgrammingError:
-            return
+        "Number of notes successfully added on day"
+        return self.countDay(day, "notes")
 
     def purge(self):
-        self.c.execute("""
-        DROP TABLE IF EXISTS lookups,notes
-        """)
-        self.createTables()
+        self.flush()
+        with self.db.write() as conn:
+            for table in ("lookups", "notes", "daily_stats", "daily_words"):
+                self.c.execute(f"DROP TABLE IF EXISTS {table}")
+            setVersion(conn, 0)
+            migrate(self.db, self.migrations())
+
+
+# Catalog row of a local dictionary, as used for lookups
+DictInfo = namedtuple("DictInfo", "id storage path type zdict typos language")
+
+
+# Every LocalDictionary, to tell when a database is not used any more
+_dictionaries: "weakref.WeakSet[LocalDictionary]" = weakref.WeakSet()
+
+
+def currentDictPath() -> str:
+    "Path of the dictionary database in use"
+    try:
+        with open(dictpointer, encoding="utf-8") as f:
+            return path.join(datapath, f.read().strip())
+    except FileNotFoundError:
+        return path.join(datapath, "dict.db")
 
 
 class LocalDictionary():
-    def __init__(self):
-        self.conn = sqlite3.connect(
-            path.join(
-                datapath,
-                "dict.db"),
-            check_same_thread=False)
-        self.c = self.conn.cursor()
-        self.createTables()
+    def __init__(self, filepath=None):
+        "Open the dictionary database in use, or the one at filepath"
+        self.path = filepath or currentDictPath()
+        # Ids of the dictionaries a shadow database was created with. Their
+        # files are still used by the live database, so they are only
+        # removed once the shadow replaces it.
+        self.inherited = set()
+        self.orphans = []
+        # (name, language) -> DictInfo
+        self.catalog = {}
+        # dict_id -> opened dictionaries that are not stored in the entries table
+        self.mounts = {}
+        # (name, language) -> ({word: rank}, size) of frequency lists
+        self.freqtables = {}
+        # (name, language) -> sorted words of frequency lists
+        self.freqwords = {}
+        # (name, language) -> PhraseMatcher of the phrases of dictionaries
+        self.phrasematchers = {}
+        # language -> Segmenter over the headwords of its dictionaries
+        self.segmenters = {}
+        # Set by migrations that free space, which they cannot reclaim
+        # inside their transaction
+        self.compact = False
+        # Builds what is cached above when callers do not wait for it.
+        # (cache, key) -> functions to call once each of those is ready
+        self.builder = ThreadPoolExecutor(1)
+        self.building = {}
+        self.buildlock = threading.Lock()
+        # Bumped whenever the caches are cleared, so that what was built
+        # from the dictionaries as they were before is not kept
+        self.generation = 0
+        self.connect()
+        _dictionaries.add(self)
+        migrate(self.db, self.migrations())
+        if self.compact:
+            with self.db.writing():
+                self.c.execute("VACUUM")
+            self.compact = False
+
+    def connect(self):
+        # Each thread has a connection of its own. Lookups are not blocked
+        # by imports, and go on reading the database as it was when they
+        # started.
+        self.db = openDatabase(self.path, self.setupConnection)
+
+    @staticmethod
+    def setupConnection(conn):
+        conn.create_function("normalize_key", 2, normalizeKey, deterministic=True)
+
+    @property
+    def conn(self):
+        return self.db.conn
+
+    @property
+    def c(self):
+        return self.db.cursor
+
+    def migrations(self):
+        "Changes to the schema of the dictionary database, in the order they were made"
+        return [self.createTables, self.migrateLegacy, self.addColumns, self.addTypos, self.addStamps]
 
     def createTables(self):
+        # Catalog of imported dictionaries. Entries refer to it by id, so
+        # the (long) name and language are not repeated on every row.
         self.c.execute("""
-        CREATE TABLE IF NOT EXISTS dictionary (
-            word TEXT,
+        CREATE TABLE IF NOT EXISTS dictionaries (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            language TEXT NOT NULL,
+            type TEXT,
+            hash TEXT,
+            stamp TEXT,
+            storage TEXT NOT NULL DEFAULT 'db',
+            path TEXT,
+            zdict BLOB,
+            search INTEGER NOT NULL DEFAULT 0,
+            typos INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (name, language)
+        )
+        """)
+        # storage is 'db' for dictionaries copied into the entries table,
+        # 'mount' for those looked up in place from path, or 'compiled'
+        # for those compiled into a read-only file at path.
+        # zdict is the preset zlib dictionary of a compressed dictionary;
+        # its definitions are stored as BLOBs instead of TEXT.
+        # search is set for dictionaries with a full-text index, which is
+        # kept in a separate FTS5 table named by searchTable().
+        # typos is set for dictionaries whose headwords are in the
+        # variants table, so that suggest() skips the others.
+        # Clustered on (dict_id, word): all entries of a dictionary are
+        # stored contiguously. key is the headword as normalized by
+        # normalizeKey(), which lookups go through, so that they find
+        # entries whatever the case or stress marks of the query.
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS entries (
+            dict_id INTEGER NOT NULL,
+            word TEXT NOT NULL,
+            key TEXT,
             definition TEXT,
-            language TEXT,
-            dictname TEXT
+            PRIMARY KEY (dict_id, word)
+        ) WITHOUT ROWID
+        """)
+        # Inflected forms of headwords, so that they can be looked up
+        # without running a lemmatizer. form is normalized like entries.key.
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS forms (
+            dict_id INTEGER NOT NULL,
+            form TEXT NOT NULL,
+            word TEXT NOT NULL,
+            PRIMARY KEY (dict_id, form, word)
+        ) WITHOUT ROWID
+        """)
+        # Deletion variants of normalized headwords, for typo-tolerant
+        # lookups (see fuzzy.py)
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS variants (
+            dict_id INTEGER NOT NULL,
+            variant TEXT NOT NULL,
+            word TEXT NOT NULL,
+            PRIMARY KEY (dict_id, variant, word)
+        ) WITHOUT ROWID
+        """)
+        # Dictionaries that were deleted from the catalog, whose entries
+        # are still to be removed by collectGarbage(). Their ids are not
+        # given to new dictionaries until then.
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS garbage (
+            dict_id INTEGER PRIMARY KEY
         )
         """)
-        self.conn.commit()
 
-    def importdict(self, data: dict, lang: str, name: str):
-        for item in data.items():
-            # Handle escape sequences
+    def migrateLegacy(self):
+        """
+        Older versions kept every entry in a single unindexed table called
+        'dictionary'. Move its contents to the new layout, then drop it.
+        """
+        self.c.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type='table' AND name='dictionary'
+        """)
+        if self.c.fetchone() is None:
+            return
+        print("Migrating dictionary database to the new layout..")
+        self.c.execute("""
+        INSERT OR IGNORE INTO dictionaries(name, language)
+        SELECT DISTINCT dictname, language FROM dictionary
+        WHERE dictname IS NOT NULL AND language IS NOT NULL
+        """)
+        # OR IGNORE keeps the first of any duplicate headwords, which is
+        # the one the old define() returned
+        self.c.execute("""
+        INSERT OR IGNORE INTO entries(dict_id, word, key, definition)
+        SELECT dictionaries.id, dictionary.word,
+            normalize_key(dictionary.word, dictionary.language), dictionary.definition
+        FROM dictionary
+        JOIN dictionaries
+        ON dictionaries.name = dictionary.dictname
+        AND dictionaries.language = dictionary.language
+        WHERE dictionary.word IS NOT NULL
+        ORDER BY dictionary.rowid
+        """)
+        self.c.execute("DROP TABLE dictionary")
+        self.compact = True
+
+    def addColumns(self):
+        """
+        Add the columns that databases created before versioning may lack,
+        fill in the keys of their entries, then index the keys
+        """
+        for column in ("storage TEXT NOT NULL DEFAULT 'db'", "path TEXT", "zdict BLOB",
+                       "search INTEGER NOT NULL DEFAULT 0"):
+            try:
+                self.c.execute(f"ALTER TABLE dictionaries ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        try:
+            self.c.execute("ALTER TABLE entries ADD COLUMN key TEXT")
             self.c.execute("""
-                INSERT INTO dictionary(word, definition, language, dictname)
-                VALUES(?, ?, ?, ?)
-                """,
-                           (
-                               item[0].lower() if item[0].isupper() else item[0],  # no caps
-                               item[1].replace("\\n", "\n"),
-                               lang,
-                               name
-                           )
-                           )
-        self.conn.commit()
-
-    def deletedict(self, name: str):
-        self.c.execute("""
-            DELETE FROM dictionary
-            WHERE dictname=?
+            UPDATE entries SET key=normalize_key(
+                word, (SELECT language FROM dictionaries WHERE id=entries.dict_id))
+            """)
+        except sqlite3.OperationalError:
+            pass
+        self.createKeyIndex()
+
+    def addTypos(self):
+        "Flag the dictionaries that were indexed for suggest()"
+        try:
+            self.c.execute("ALTER TABLE dictionaries ADD COLUMN typos INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        self.c.execute("""
+        UPDATE dictionaries SET typos=EXISTS(
+            SELECT 1 FROM variants WHERE dict_id=dictionaries.id)
+        """)
+
+    def addStamps(self):
+        "Make room for the stamps of the sources of dictionaries, see setDictHash()"
+        try:
+            self.c.execute("ALTER TABLE dictionaries ADD COLUMN stamp TEXT")
+        except sqlite3.OperationalError:
+            pass
+
+    def createKeyIndex(self):
+        self.c.execute("""
+        CREATE INDEX IF NOT EXISTS entries_key ON entries(dict_id, key)
+        """)
+
+    def dropKeyIndex(self) -> bool:
+        """
+        Drop the index on entries.key, which is quicker to build again
+        after a bulk load than to update row by row.
+        Return whether there was one.
+        """
+        self.c.execute("""
+        SELECT 1 FROM sqlite_master WHERE type='index' AND name='entries_key'
+        """)
+        if self.c.fetchone() is None:
+            return False
+        self.c.execute("DROP INDEX entries_key")
+        return True
+
+    def getDictId(self, name: str, lang: str, create=False, dicttype=None):
+        "Get the catalog id of a dictionary, optionally registering it"
+        if create:
+            self.c.execute("""
+            INSERT OR IGNORE INTO dictionaries(id, name, language, type)
+            VALUES((SELECT MAX(id) + 1 FROM (
+                SELECT id FROM dictionaries UNION ALL SELECT dict_id FROM garbage
+            )), ?, ?, ?)
+            """, (name, lang, dicttype))
+        self.c.execute("""
+        SELECT id FROM dictionaries
+        WHERE name=?
+        AND language=?
+        """, (name, lang))
+        res = self.c.fetchone()
+        return res[0] if res else None
+
+    def getDictInfo(self, name: str, lang: str):
+        "Return the DictInfo of a dictionary, or None if it does not exist"
+        if (info := self.catalog.get((name, lang))) is None:
+            self.c.execute("""
+            SELECT id, storage, path, type, zdict, typos, language FROM dictionaries
+            WHERE name=?
+            AND language=?
+            """, (name, lang))
+            row = self.c.fetchone()
+            if row is not None:
+                info = self.catalog[(name, lang)] = DictInfo(*row)
+        return info
+
+    def forgetCatalog(self):
+        "Drop everything cached about dictionaries after they change"
+        self.catalog.clear()
+        self.freqtables.clear()
+        self.freqwords.clear()
+        with self.buildlock:
+            self.phrasematchers.clear()
+            self.segmenters.clear()
+            self.generation += 1
+
+    def cached(self, cache: dict, key, build, wait=True, ready=None):
+        """
+        Return cache[key], filling it in with build() if missing. Unless
+        wait, it is built in the background and None is returned until
+        it is done; ready() is then called, from the background thread.
+        """
+        if (value := cache.get(key)) is not None:
+            return value
+        if wait:
+            value = cache[key] = build()
+            return value
+        with self.buildlock:
+            if (waiting := self.building.get((id(cache), key))) is None:
+                waiting = self.building[(id(cache), key)] = []
+                self.builder.submit(self.buildCached, cache, key, build, self.generation)
+            if ready is not None:
+                waiting.append(ready)
+        return None
+
+    def buildCached(self, cache: dict, key, build, generation):
+        try:
+            value = build()
+        except Exception:
+            with self.buildlock:
+                del self.building[(id(cache), key)]
+            raise
+        with self.buildlock:
+            if generation == self.generation:
+                cache[key] = value
+            waiting = self.building.pop((id(cache), key))
+        # Callers of an outdated build ask again, and get a new one
+        for ready in waiting:
+            ready()
+
+    def getFreqTable(self, name: str, lang: str):
+        """
+        Return the ranks of a frequency list as a dict keyed by
+        normalizeKey(), and the size of the list.
+        The list is read once and kept until dictionaries change.
+        """
+        if (table := self.freqtables.get((name, lang))) is None:
+            info = self.getDictInfo(name, lang)
+            if info is None:
+                ranks = {}
+            elif info.storage == 'compiled':
+                mount = self.getMount(info)
+                ranks = {mount.key(i).decode("utf-8"): int(mount.definitionAt(i))
+                         for i in range(len(mount))}
+            else:
+                self.c.execute("""
+                SELECT key, definition FROM entries
+                WHERE dict_id=?
+                """, (info.id,))
+                ranks = {key: int(self.decodeDefinition(rank, info.zdict))
+                         for key, rank in self.c}
+            table = self.freqtables[(name, lang)] = (ranks, len(ranks))
+        return table
+
+    def getFrequentWithPrefix(self, name: str, lang: str, prefix: str, limit: int) -> list:
+        "Return the limit most frequent words of a frequency list that start with prefix"
+        ranks, _ = self.getFreqTable(name, lang)
+        if (words := self.freqwords.get((name, lang))) is None:
+            words = self.freqwords[(name, lang)] = sorted(ranks)
+        key = normalizeKey(prefix, lang)
+        lo = bisect_left(words, key)
+        hi = bisect_left(words, key + "\U0010ffff", lo)
+        return heapq.nsmallest(limit, words[lo:hi], key=ranks.__getitem__)
+
+    def complete(self, prefix: str, lang: str, name: str, limit: int) -> list:
+        "Return up to limit headwords of a dictionary starting with prefix, in order"
+        info = self.getDictInfo(name, lang)
+        if info is None or not prefix:
+            return []
+        key = normalizeKey(prefix, lang)
+        if info.storage == 'compiled':
+            return list(islice(self.getMount(info).wordsFrom(key), limit))
+        if info.storage == 'mount':
+            return list(islice(self.getMount(info).index.wordsFrom(key), limit))
+        self.c.execute("""
+        SELECT word FROM entries INDEXED BY entries_key
+        WHERE dict_id=?
+        AND key >= ?
+        AND key < ?
+        ORDER BY key
+        LIMIT ?
+        """, (info.id, key, key + "\U0010ffff", limit))
+        return [word for word, in self.c.fetchall()]
+
+    def getPhraseMatcher(self, name: str, lang: str, wait=True, ready=None) -> Optional[PhraseMatcher]:
+        """
+        Return a matcher of the multi-word headwords of a dictionary.
+        It is compiled on first use and kept until dictionaries change.
+        See cached() for wait and ready.
+        """
+        return self.cached(self.phrasematchers, (name, lang),
+                           lambda: buildMatcher(self.headwords(name, lang), lang), wait, ready)
+
+    def getSegmenter(self, lang: str, wait=True, ready=None) -> Optional[Segmenter]:
+        """
+        Return a segmenter whose lexicon is the headwords and inflected
+        forms of every dictionary of a language. It is built on first use
+        and kept until dictionaries change.
+        See cached() for wait and ready.
+        """
+        return self.cached(self.segmenters, lang, lambda: self.buildSegmenter(lang), wait, ready)
+
+    def buildSegmenter(self, lang: str) -> Segmenter:
+        words = chain.from_iterable(
+            self.headwords(name, lang) for name in self.getNamesForLang(lang))
+        forms = (form for form, in self.conn.execute("""
+            SELECT DISTINCT form FROM forms
+            WHERE dict_id IN (SELECT id FROM dictionaries WHERE language=?)
+            """, (lang,)))
+        return Segmenter(chain(words, forms))
+
+    def getMount(self, info: DictInfo):
+        "Open a dictionary that is stored outside of the entries table"
+        if (mount := self.mounts.get(info.id)) is None:
+            if info.storage == 'compiled':
+                mount = CompiledDictionary(info.path)
+            else:
+                mount = mountDictionary(
+                    info.path, info.type, path.join(mountpath, str(info.id)),
+                    lambda word: normalizeKey(word, info.language))
+            self.mounts[info.id] = mount
+        return mount
+
+    def getMountsByName(self, name: str):
+        self.c.execute("""
+        SELECT id, storage, path, type, zdict, typos, language FROM dictionaries
+        WHERE name=?
+        AND storage!='db'
         """, (name,))
-        self.conn.commit()
+        return [self.getMount(DictInfo(*row)) for row in self.c.fetchall()]
 
-    def define(self, word: str, lang: str, name: str) -> str:
+    @staticmethod
+    def searchTable(dict_id) -> str:
+        return f"fts_{int(dict_id)}"
+
+    @staticmethod
+    def searchText(definition: str) -> str:
+        "Plain text of a definition, as indexed for full-text search"
+        return html.unescape(re.sub(r"<[^>]*>", " ", definition))
+
+    def createSearchIndex(self, dict_id):
+        "Create an empty full-text index for a dictionary, replacing any previous one"
+        table = self.searchTable(dict_id)
+        self.c.execute(f"DROP TABLE IF EXISTS {table}")
+        self.c.execute(f"""
+        CREATE VIRTUAL TABLE {table} USING fts5(
+            word UNINDEXED,
+            text,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """)
+        self.c.execute("""
+        UPDATE dictionaries SET search=1
+        WHERE id=?
+        """, (dict_id,))
+
+    def addToSearchIndex(self, dict_id, entries):
+        self.c.executemany(f"""
+            INSERT INTO {self.searchTable(dict_id)}(word, text)
+            VALUES(?, ?)
+            """, [(word, self.searchText(definition)) for word, definition in entries])
+
+    def indexSearch(self, name: str, lang: str, progress=None) -> int:
+        """
+        Build the full-text index of a dictionary from its entries.
+        Dictionaries imported into the database are indexed while they are
+        imported instead.
+        """
+        count = 0
+        with self.db.write():
+            dict_id = self.getDictId(name, lang)
+            entries = self.iterEntries(name, lang)
+            self.createSearchIndex(dict_id)
+            while chunk := list(islice(entries, IMPORT_CHUNK_SIZE)):
+                self.addToSearchIndex(dict_id, chunk)
+                count += len(chunk)
+                if progress is not None:
+                    progress(count)
+        return count
+
+    def search(self, query: str, lang: str, name: str, limit=SEARCH_LIMIT):
+        """
+        Find the headwords whose definitions contain every word of query,
+        best matches first. A word ending with * matches any word it starts.
+        Return a list of (headword, snippet) pairs, where snippet is an
+        HTML excerpt of the definition with the matches in bold.
+        """
+        info = self.getDictInfo(name, lang)
+        terms = [
+            '"' + term.rstrip("*").replace('"', '""') + '"' + ("*" if term.endswith("*") else "")
+            for term in query.split() if term.rstrip("*")
+        ]
+        if info is None or not terms:
+            return []
+        table = self.searchTable(info.id)
+        try:
+            self.c.execute(f"""
+            SELECT word, snippet({table}, 1, '<b>', '</b>', '…', 16) FROM {table}
+            WHERE {table} MATCH ?
+            ORDER BY rank
+            LIMIT ?
+            """, (" ".join(terms), limit))
+        except sqlite3.OperationalError:  # Not indexed
+            return []
+        return self.c.fetchall()
+
+    def getSearchableNamesForLang(self, lang: str):
+        "Names of the dictionaries of a language that have a full-text index"
+        self.c.execute("""
+        SELECT name FROM dictionaries
+        WHERE language=?
+        AND search
+        """, (lang,))
+        return [name for name, in self.c.fetchall()]
+
+    def removeFiles(self, dict_id):
+        "Remove the files kept for a dictionary outside of the database"
+        self.mounts.pop(dict_id, None)
+        if dict_id in self.inherited:
+            self.orphans.append(dict_id)
+            return
+        unmountDictionary(path.join(mountpath, str(dict_id)))
+        try:
+            os.remove(path.join(compiledpath, f"{dict_id}.vsd"))
+        except OSError:
+            # Missing, or still mapped on Windows: see removeStale()
+            pass
+
+    def mountdict(self, filepath, dicttype: str, lang: str, name: str, progress=None):
+        """
+        Register a dictionary that is looked up in place from its original
+        files instead of being copied into the database.
+        Only a headword index is built.
+        """
+        self.forgetCatalog()
+        with self.db.write():
+            dict_id = self.getDictId(name, lang, create=True, dicttype=dicttype)
+            # May be left over from a dictionary that had the same id before
+            self.removeFiles(dict_id)
+            try:
+                mount = self.mounts[dict_id] = mountDictionary(
+                    filepath, dicttype, path.join(mountpath, str(dict_id)),
+                    lambda word: normalizeKey(word, lang), progress)
+                self.c.execute("""
+                UPDATE dictionaries SET storage='mount', path=?
+                WHERE id=?
+                """, (filepath, dict_id))
+            except BaseException:
+                self.removeFiles(dict_id)
+                raise
+        return len(mount)
+
+    def compiledict(self, data, lang: str, name: str, dicttype=None, progress=None):
+        """
+        Like importdict, but compile the entries into a read-only file
+        which is memory-mapped for lookups, instead of the entries table.
+        """
+        self.forgetCatalog()
+        with self.db.write():
+            dict_id = self.getDictId(name, lang, create=True, dicttype=dicttype)
+            self.removeFiles(dict_id)
+            filepath = path.join(compiledpath, f"{dict_id}.vsd")
+            try:
+                count = writeCompiled(self.prepareEntries(data), filepath,
+                                      lambda word: normalizeKey(word, lang), progress)
+                self.c.execute("""
+                UPDATE dictionaries SET storage='compiled', path=?
+                WHERE id=?
+                """, (filepath, dict_id))
+            except BaseException:
+                self.removeFiles(dict_id)
+                raise
+        return count
+
+    def prepareEntries(self, data):
+        "Normalize (headword, definition) pairs before they are stored"
+        if isinstance(data, dict):
+            data = data.items()
+        return (
+            (
+                headword.lower() if headword.isupper() else headword,  # no caps
+                definition.replace("\\n", "\n"),  # Handle escape sequences
+            )
+            for headword, definition in data
+        )
+
+    def importdict(self, data, lang: str, name: str, dicttype=None, progress=None, compress=False,
+                   search=False):
+        """
+        Import entries in a single transaction.
+        data can be a dict or any iterable of (headword, definition) pairs;
+        it is consumed in chunks, so it is never held in memory at once.
+        progress, if given, is called with the number of entries written so far.
+        With compress, definitions are compressed with a preset dictionary
+        trained on the first entries.
+        With search, a full-text index of the definitions is built as well.
+        """
+        rows = self.prepareEntries(data)
+        zdict = None
+        if compress:
+            head = list(islice(rows, compression.TRAIN_SAMPLES))
+            zdict = compression.train([definition.encode("utf-8") for _, definition in head])
+            rows = chain(head, rows)
+        self.forgetCatalog()
+        # The pragmas apply to the writer connection, and cannot be
+        # changed inside a transaction
+        with self.db.writing():
+            self.c.execute("PRAGMA synchronous")
+            synchronous = self.c.fetchone()[0]
+            self.c.execute("PRAGMA cache_size")
+            cache_size = self.c.fetchone()[0]
+            # A crash mid-import only loses the import itself, which is rolled
+            # back or redone anyway, so there is no need to sync every page.
+            # The journal mode is left alone: leaving WAL needs every other
+            # connection closed, and a failed import must still roll back.
+            self.c.execute("PRAGMA synchronous=OFF")
+            self.c.execute(f"PRAGMA cache_size=-{IMPORT_CACHE_KIB}")
+            try:
+                with self.db.write():
+                    # Into an empty table, the index is quicker to build at
+                    # the end; otherwise rebuilding it would cover the entries
+                    # of every other dictionary. In the same transaction, so
+                    # lookups never miss it. A shadow database being rebuilt
+                    # has none until the end.
+                    self.c.execute("""
+                    SELECT 1 FROM entries
+                    LIMIT 1
+                    """)
+                    reindex = self.c.fetchone() is None and self.dropKeyIndex()
+                    dict_id = self.getDictId(name, lang, create=True, dicttype=dicttype)
+                    self.c.execute("""
+                    UPDATE dictionaries SET zdict=?
+                    WHERE id=?
+                    """, (zdict, dict_id))
+                    if search:
+                        self.createSearchIndex(dict_id)
+                    count = 0
+                    while chunk := list(islice(rows, IMPORT_CHUNK_SIZE)):
+                        self.c.executemany("""
+                            INSERT OR REPLACE INTO entries(dict_id, word, key, definition)
+                            VALUES(?, ?, ?, ?)
+                            """, [(dict_id, word, normalizeKey(word, lang),
+                                   self.encodeDefinition(definition, zdict))
+                                  for word, definition in chunk])
+                        if search:
+                            self.addToSearchIndex(dict_id, chunk)
+                        count += len(chunk)
+                        if progress is not None:
+                            progress(count)
+                    if reindex:
+                        self.createKeyIndex()
+            finally:
+                self.c.execute(f"PRAGMA synchronous={synchronous}")
+                self.c.execute(f"PRAGMA cache_size={cache_size}")
+        return count
+
+    @staticmethod
+    def encodeDefinition(definition: str, zdict):
+        "Compress a definition if that makes it smaller"
+        if zdict is None:
+            return definition
+        data = definition.encode("utf-8")
+        compressed = compression.compress(data, zdict)
+        return compressed if len(compressed) < len(data) else definition
+
+    @staticmethod
+    def decodeDefinition(definition, zdict) -> str:
+        "Compressed definitions are BLOBs, others are TEXT"
+        if isinstance(definition, bytes):
+            return compression.decompress(definition, zdict).decode("utf-8")
+        return str(definition)
+
+    def deletedict(self, name: str, lang=None):
+        """
+        Delete the dictionaries called name, only the one of lang if given.
+        Only their catalog entries are removed, which is immediate; the rest
+        is left to collectGarbage().
+        """
+        with self.db.write():
+            self.c.execute("""
+                SELECT id FROM dictionaries
+                WHERE name=?
+                AND (? IS NULL OR language=?)
+            """, (name, lang, lang))
+            for dict_id, in self.c.fetchall():
+                self.mounts.pop(dict_id, None)
+                self.c.execute("""
+                    INSERT OR IGNORE INTO garbage(dict_id)
+                    VALUES(?)
+                """, (dict_id,))
+                self.c.execute("""
+                    DELETE FROM dictionaries
+                    WHERE id=?
+                """, (dict_id,))
+        self.forgetCatalog()
+
+    def hasGarbage(self) -> bool:
+        self.c.execute("""
+        SELECT 1 FROM garbage
+        LIMIT 1
+        """)
+        return self.c.fetchone() is not None
+
+    def collectGarbage(self) -> int:
+        "Remove everything left of deleted dictionaries. Return how many there were."
+        with self.db.write():
+            self.c.execute("""
+            SELECT dict_id FROM garbage
+            """)
+            ids = [dict_id for dict_id, in self.c.fetchall()]
+            for dict_id in ids:
+                self.removeFiles(dict_id)
+                self.c.execute(f"DROP TABLE IF EXISTS {self.searchTable(dict_id)}")
+                for table in ("entries", "forms", "variants", "garbage"):
+                    self.c.execute(f"""
+                        DELETE FROM {table}
+                        WHERE dict_id=?
+                    """, (dict_id,))
+        return len(ids)
+
+    def shadow(self) -> "LocalDictionary":
+        """
+        Copy the database to a new file, in which dictionaries can be
+        changed at length without disturbing lookups in this one.
+        Switch to it with swap() when done, or throw it away with discard().
+        """
+        shadowpath = path.join(datapath, f"dict-{time.time_ns()}.db")
+        # Through connections of their own, so that lookups do not wait
+        source = sqlite3.connect(self.path)
+        dest = sqlite3.connect(shadowpath)
+        source.backup(dest)
+        dest.close()
+        source.close()
+        shadow = LocalDictionary(shadowpath)
+        shadow.c.execute("""
+        SELECT id FROM dictionaries UNION ALL SELECT dict_id FROM garbage
+        """)
+        shadow.inherited = {dict_id for dict_id, in shadow.c.fetchall()}
+        return shadow
+
+    def swap(self, shadow: "LocalDictionary"):
+        """
+        Switch to a shadow database. Lookups already running finish on the
+        old one, which is removed once every LocalDictionary has followed,
+        see reload().
+        """
+        shadow.db.close()
+        writeatomic(dictpointer, path.basename(shadow.path).encode("utf-8"))
+        self.reload()
+        for dict_id in shadow.orphans:
+            self.removeFiles(dict_id)
+
+    def reload(self):
+        """
+        Forget what is cached about dictionaries, which another connection
+        changed, and follow it if it swapped the database in use
+        """
+        self.forgetCatalog()
+        if (current := currentDictPath()) != self.path:
+            old = self.path
+            self.path = current
+            self.connect()
+            self.mounts.clear()
+            # Others, such as the GUI's while a worker swapped, may still
+            # open connections to it until they reload too
+            if not any(d.path == old for d in _dictionaries):
+                self.removeDatabase(old)
+        else:
+            # Those of deleted dictionaries, whose ids may be given again
+            self.c.execute("""
+            SELECT id FROM dictionaries
+            """)
+            ids = {dict_id for dict_id, in self.c.fetchall()}
+            for dict_id in list(self.mounts):
+                if dict_id not in ids:
+                    del self.mounts[dict_id]
+
+    def discard(self):
+        "Throw away a shadow database, and the files of the dictionaries added to it"
         self.c.execute("""
-        SELECT definition FROM dictionary
-        WHERE word=?
+        SELECT id FROM dictionaries
+        """)
+        for dict_id, in self.c.fetchall():
+            if dict_id not in self.inherited:
+                self.removeFiles(dict_id)
+        self.db.close()
+        self.removeDatabase(self.path)
+
+    @staticmethod
+    def removeDatabase(filepath):
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            try:
+                os.remove(filepath + suffix)
+            except OSError:
+                # Missing, or still open on Windows: see removeStale()
+                pass
+
+    def removeStale(self):
+        """
+        Remove the databases and dictionary files that are not used any
+        more, but could not be removed when they stopped being used, or
+        were left behind by an interrupted rebuild
+        """
+        current = path.basename(self.path)
+        for fname in os.listdir(datapath):
+            if (m := re_dictdb.fullmatch(fname)) and m.group(1) != current:
+                self.removeDatabase(path.join(datapath, m.group(1)))
+        self.c.execute("""
+        SELECT id FROM dictionaries UNION ALL SELECT dict_id FROM garbage
+        """)
+        ids = {str(dict_id) for dict_id, in self.c.fetchall()}
+        for folder in (mountpath, compiledpath):
+            for fname in os.listdir(folder):
+                if fname.split(".")[0] not in ids:
+                    try:
+                        os.remove(path.join(folder, fname))
+                    except OSError:
+                        pass
+
+    def getDictHash(self, name: str, lang: str):
+        """
+        Return the stamp and the hash of the sources a dictionary was
+        imported from, either of which may be unknown
+        """
+        self.c.execute("""
+        SELECT stamp, hash FROM dictionaries
+        WHERE name=?
         AND language=?
-        AND dictname=?
-        """, (word, lang, name))
-        return str(self.c.fetchone()[0])
+        """, (name, lang))
+        res = self.c.fetchone()
+        return res if res else (None, None)
+
+    def setDictHash(self, name: str, lang: str, stamp: str, digest=None):
+        """
+        Record the stampSource() of the sources of a dictionary, and their
+        hashSource() if it was computed
+        """
+        with self.db.write():
+            self.c.execute("""
+            UPDATE dictionaries SET stamp=?, hash=?
+            WHERE name=?
+            AND language=?
+            """, (stamp, digest, name, lang))
+
+    def getDicts(self) -> list:
+        "Return the (name, language) of every dictionary"
+        self.c.execute("""
+        SELECT name, language FROM dictionaries
+        """)
+        return self.c.fetchall()
+
+    def define(self, word: str, lang: str, name: str) -> str:
+        info = self.getDictInfo(name, lang)
+        if info is not None and info.storage != 'db':
+            definition = self.getMount(info).define(word, normalizeKey(word, lang))
+            if definition is None:
+                raise KeyError(word)
+            return definition
+        # Prefer the entry spelled exactly like word, if there is one.
+        # Without statistics, SQLite would rather scan the whole dictionary
+        # through the primary key than use the index on key.
+        self.c.execute("""
+        SELECT definition FROM entries INDEXED BY entries_key
+        WHERE dict_id=?
+        AND key=?
+        ORDER BY word=? DESC
+        LIMIT 1
+        """, (info and info.id, normalizeKey(word, lang), word))
+        return self.decodeDefinition(self.c.fetchone()[0], info and info.zdict)
+
+    def define_many(self, words, lang: str, name: str) -> dict:
+        """
+        Look up many words at once. Return a dict of the words that were
+        found and their definitions; words that are not found are left out.
+        """
+        words = list(dict.fromkeys(words))
+        info = self.getDictInfo(name, lang)
+        if info is None:
+            return {}
+        if info.storage != 'db':
+            mount = self.getMount(info)
+            return {word: definition for word in words
+                    if (definition := mount.define(word, normalizeKey(word, lang))) is not None}
+        keys = {word: normalizeKey(word, lang) for word in words}
+        unique_keys = list(dict.fromkeys(keys.values()))
+        # key -> {headword: definition}
+        found = {}
+        for i in range(0, len(unique_keys), DEFINE_CHUNK_SIZE):
+            chunk = unique_keys[i:i + DEFINE_CHUNK_SIZE]
+            self.c.execute(f"""
+            SELECT key, word, definition FROM entries INDEXED BY entries_key
+            WHERE dict_id=?
+            AND key IN ({",".join("?" * len(chunk))})
+            """, (info.id, *chunk))
+            for key, headword, definition in self.c.fetchall():
+                found.setdefault(key, {})[headword] = definition
+        res = {}
+        for word, key in keys.items():
+            if (entries := found.get(key)) is not None:
+                definition = entries.get(word, next(iter(entries.values())))
+                res[word] = self.decodeDefinition(definition, info.zdict)
+        return res
+
+    def distinctCandidates(self, words, lang: str, name: str) -> list:
+        "Drop the words that would find the same entry as an earlier one"
+        info = self.getDictInfo(name, lang)
+        if info is None:
+            return list(words)
+        res = {}
+        for word in words:
+            res.setdefault(normalizeKey(word, lang), word)
+        return list(res.values())
+
+    def headwords(self, name: str, lang: str):
+        "Iterate over the headwords of a dictionary, whatever its storage"
+        info = self.getDictInfo(name, lang)
+        if info is None:
+            return
+        if info.storage == 'compiled':
+            mount = self.getMount(info)
+            for i in range(len(mount)):
+                yield mount.word(i).decode("utf-8")
+        elif info.storage == 'mount':
+            yield from self.getMount(info).index.words()
+        else:
+            # A separate cursor, so that callers can query while iterating
+            yield from (word for word, in self.conn.execute("""
+                SELECT word FROM entries
+                WHERE dict_id=?
+                """, (info.id,)))
+
+    def iterEntries(self, name: str, lang: str):
+        "Iterate over the (headword, definition) pairs of a dictionary, whatever its storage"
+        info = self.getDictInfo(name, lang)
+        if info is None:
+            return
+        if info.storage == 'compiled':
+            mount = self.getMount(info)
+            for i in range(len(mount)):
+                yield mount.word(i).decode("utf-8"), mount.definitionAt(i)
+        elif info.storage == 'mount':
+            mount = self.getMount(info)
+            for word in dict.fromkeys(mount.index.words()):
+                yield word, mount.define(word, normalizeKey(word, lang))
+        else:
+            for word, definition in self.conn.execute("""
+                SELECT word, definition FROM entries
+                WHERE dict_id=?
+                """, (info.id,)):
+                yield word, self.decodeDefinition(definition, info.zdict)
+
+    def addForms(self, name: str, lang: str, forms, progress=None) -> int:
+        """
+        Record (form, headword) pairs of a dictionary in a single transaction.
+        Forms that normalize to the headword itself are skipped.
+        Return the number of pairs recorded.
+        """
+        count = 0
+        with self.db.write():
+            dict_id = self.getDictId(name, lang)
+            rows = (
+                (dict_id, key, headword) for form, headword in forms
+                if (key := normalizeKey(form, lang)) != normalizeKey(headword, lang)
+            )
+            while chunk := list(islice(rows, IMPORT_CHUNK_SIZE)):
+                self.c.executemany("""
+                    INSERT OR IGNORE INTO forms(dict_id, form, word)
+                    VALUES(?, ?, ?)
+                    """, chunk)
+                count += self.c.rowcount
+                if progress is not None:
+                    progress(count)
+        return count
+
+    def indexVariants(self, name: str, lang: str, progress=None) -> int:
+        "Index the deletion variants of the headwords of a dictionary, for suggest()"
+        count = 0
+        with self.db.write():
+            dict_id = self.getDictId(name, lang)
+            rows = (
+                (dict_id, variant, headword) for headword in self.headwords(name, lang)
+                for variant in fuzzy.deletions(normalizeKey(headword, lang))
+            )
+            while chunk := list(islice(rows, IMPORT_CHUNK_SIZE)):
+                self.c.executemany("""
+                    INSERT OR IGNORE INTO variants(dict_id, variant, word)
+                    VALUES(?, ?, ?)
+                    """, chunk)
+                count += len(chunk)
+                if progress is not None:
+                    progress(count)
+            self.c.execute("""
+            UPDATE dictionaries SET typos=1
+            WHERE id=?
+            """, (dict_id,))
+        self.forgetCatalog()
+        return count
+
+    def suggest(self, word: str, lang: str, name: str, limit=5) -> list:
+        """
+        Return up to limit headwords of a dictionary within fuzzy.MAX_DISTANCE
+        edits of word, closest first. Only dictionaries indexed with
+        indexVariants() have any.
+        """
+        info = self.getDictInfo(name, lang)
+        if info is None or not info.typos:
+            return []
+        dict_id = info.id
+        key = normalizeKey(word, lang)
+        variants = list(fuzzy.deletions(key))
+        self.c.execute(f"""
+        SELECT DISTINCT word FROM variants
+        WHERE dict_id=?
+        AND variant IN ({",".join("?" * len(variants))})
+        """, (dict_id, *variants))
+        candidates = sorted(
+            (abs(len(headword) - len(word)), headword) for headword, in self.c.fetchall())
+        res = []
+        bound = fuzzy.MAX_DISTANCE
+        for lengthdiff, headword in candidates:
+            distance = fuzzy.editDistance(key, normalizeKey(headword, lang), bound)
+            if distance <= bound:
+                res.append((distance, lengthdiff, headword))
+                if len(res) >= limit:
+                    # Candidates further away than those found are not needed
+                    res.sort()
+                    res = res[:limit]
+                    bound = res[-1][0]
+        return [headword for *_, headword in sorted(res)]
+
+    def defineForms(self, words, lang: str, name: str) -> dict:
+        """
+        Look up words as inflected forms of headwords. Return a dict of the
+        words that were found to (headword, definition).
+        """
+        info = self.getDictInfo(name, lang)
+        if info is None:
+            return {}
+        keys = {word: normalizeKey(word, lang) for word in words}
+        unique_keys = list(dict.fromkeys(keys.values()))
+        # form -> headword
+        found = {}
+        for i in range(0, len(unique_keys), DEFINE_CHUNK_SIZE):
+            chunk = unique_keys[i:i + DEFINE_CHUNK_SIZE]
+            if info.storage == 'db':
+                self.c.execute(f"""
+                SELECT forms.form, entries.word, entries.definition FROM forms
+                JOIN entries
+                ON entries.dict_id = forms.dict_id
+                AND entries.word = forms.word
+                WHERE forms.dict_id=?
+                AND forms.form IN ({",".join("?" * len(chunk))})
+                """, (info.id, *chunk))
+                for form, headword, definition in self.c.fetchall():
+                    found.setdefault(
+                        form, (headword, self.decodeDefinition(definition, info.zdict)))
+            else:
+                self.c.execute(f"""
+                SELECT form, word FROM forms
+                WHERE dict_id=?
+                AND form IN ({",".join("?" * len(chunk))})
+                """, (info.id, *chunk))
+                mount = self.getMount(info)
+                for form, headword in self.c.fetchall():
+                    if form not in found and (definition := mount.define(
+                            headword, normalizeKey(headword, lang))) is not None:
+                        found[form] = (headword, definition)
+        return {word: found[key] for word, key in keys.items() if key in found}
 
     def countEntries(self) -> int:
         self.c.execute("""
-        SELECT COUNT(*) FROM dictionary
+        SELECT COUNT(*) FROM entries
+        WHERE dict_id IN (SELECT id FROM dictionaries)
         """)
-        return int(self.c.fetchone()[0])
+        count = int(self.c.fetchone()[0])
+        self.c.execute("""
+        SELECT id, storage, path, type, zdict, typos, language FROM dictionaries
+        WHERE storage!='db'
+        """)
+        return count + sum(len(self.getMount(DictInfo(*row))) for row in self.c.fetchall())
 
     def countEntriesDict(self, name) -> int:
         self.c.execute("""
-        SELECT COUNT(*) FROM dictionary
-        WHERE dictname=?
+        SELECT COUNT(*) FROM entries
+        WHERE dict_id IN (SELECT id FROM dictionaries WHERE name=?)
         """, (name,))
-        return int(self.c.fetchone()[0])
+        count = int(self.c.fetchone()[0])
+        return count + sum(len(mount) for mount in self.getMountsByName(name))
 
     def countDicts(self) -> int:
         self.c.execute("""
-        SELECT COUNT(DISTINCT dictname) FROM dictionary
+        SELECT COUNT(*) FROM dictionaries
         """)
         return int(self.c.fetchone()[0])
 
     def getNamesForLang(self, lang: str):
         self.c.row_factory = lambda cursor, row: row[0]
         self.c.execute("""
-        SELECT DISTINCT dictname FROM dictionary
+        SELECT name FROM dictionaries
         WHERE language=?
         """, (lang,))
         res = self.c.fetchall()
@@ -299,7 +1522,20 @@ class LocalDictionary():
         return res
 
     def purge(self):
-        self.c.execute("""
-        DROP TABLE IF EXISTS dictionary
-        """)
-        self.createTables()
+        with self.db.write() as conn:
+            self.c.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name GLOB 'fts_[0-9]*'
+            AND sql LIKE 'CREATE VIRTUAL TABLE%'
+            """)
+            for table, in self.c.fetchall():
+                self.c.execute(f"DROP TABLE IF EXISTS {table}")
+            for table in ("entries", "forms", "variants", "garbage", "dictionaries"):
+                self.c.execute(f"DROP TABLE IF EXISTS {table}")
+            setVersion(conn, 0)
+            migrate(self.db, self.migrations())
+        self.forgetCatalog()
+        self.mounts.clear()
+        for folder in (mountpath, compiledpath):
+            for fname in os.listdir(folder):
+                os.remove(path.join(folder, fname))
@@ -1,11 +1,18 @@
 from readmdict import MDX
 from .dsl import Reader
+from .xdxftransform import xdxf2html
 from bidict import bidict
-from typing import Dict
+from typing import Dict, Iterator, List, Tuple
 import os
 import re
 import csv
 import json
+import gzip
+import io
+import struct
+import hashlib
+from itertools import islice
+import pickle
 
 supported_dict_formats = bidict({
     "stardict": "StarDict",
@@ -19,6 +26,12 @@ supported_dict_formats = bidict({
     "tsv": "TSV (Tabfile)"
 })
 
+# Formats that can be looked up in place instead of being copied into the database
+mountable_dict_formats = ["stardict", "dsl"]
+
+# Entries written at a time to a spill file by spillDictionary()
+SPILL_CHUNK_SIZE = 10000
+
 supported_dict_extensions = [
     ".json", ".ifo", ".mdx", ".dsl", ".dz", ".csv", ".tsv"
 ]
@@ -33,10 +46,13 @@ def dictinfo(path) -> Dict[str, str]:
     if ext not in supported_dict_extensions:
         raise NotImplementedError("Unsupported format")
     elif ext == ".json":
+        # Only the first few tokens are needed to tell the type apart
         with open(path, encoding="utf-8") as f:
-            d = json.load(f)
-            if isinstance(d, list):
-                if isinstance(d[0], str):
+            stream = JSONStream(f)
+            start = stream.peek()
+            if start == "[":
+                first = next(stream.iterarray(), None)
+                if isinstance(first, str):
                     return {
                         "type": "freq",
                         "basename": basename,
@@ -45,8 +61,9 @@ def dictinfo(path) -> Dict[str, str]:
                     "type": "migaku",
                     "basename": basename,
                     "path": path}
-            elif isinstance(d, dict):
+            elif start == "{":
                 return {"type": "json", "basename": basename, "path": path}
+            raise NotImplementedError("Unsupported format")
     elif ext == ".ifo":
         return {"type": "stardict", "basename": basename, "path": path}
     elif ext == ".mdx":
@@ -62,7 +79,117 @@ def dictinfo(path) -> Dict[str, str]:
         return {"type": "csv", "basename": basename, "path": path}
 
 
-def parseMDX(path) -> Dict[str, str]:
+class JSONStream():
+    """
+    Incremental reader for a JSON document whose top level is an array
+    or an object. Elements are decoded one at a time, so only the current
+    one is held in memory, no matter how large the file is.
+    """
+
+    def __init__(self, f, bufsize=1 << 16):
+        self.f = f
+        self.bufsize = bufsize
+        self.buf = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        "Read more of the file into the buffer. Returns False at EOF."
+        more = self.f.read(self.bufsize)
+        if not more:
+            return False
+        self.buf = self.buf[self.pos:] + more
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        "Return the next non-whitespace character without consuming it"
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                break
+        return self.buf[self.pos:self.pos + 1]
+
+    def read(self) -> str:
+        "Consume the next non-whitespace character"
+        c = self.peek()
+        self.pos += len(c)
+        return c
+
+    def value(self):
+        "Decode the next complete JSON value"
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Most likely the value continues past the buffer
+                if not self._fill():
+                    raise
+                continue
+            # A number is only complete once something else follows it:
+            # cut at the end of the buffer, "1.25" decodes as 1
+            if (isinstance(obj, (int, float))
+                    and (end == len(self.buf) or self.buf[end] not in " \t\n\r,]}")
+                    and self._fill()):
+                continue
+            self.pos = end
+            return obj
+
+    def iterarray(self):
+        "Yield the elements of the array starting at the current position"
+        if self.read() != "[":
+            raise ValueError("Expected a JSON array")
+        if self.peek() == "]":
+            self.read()
+            return
+        while True:
+            yield self.value()
+            c = self.read()
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError("Malformed JSON array")
+
+    def iterobject(self):
+        "Yield the (key, value) pairs of the object starting at the current position"
+        if self.read() != "{":
+            raise ValueError("Expected a JSON object")
+        if self.peek() == "}":
+            self.read()
+            return
+        while True:
+            key = self.value()
+            if self.read() != ":":
+                raise ValueError("Malformed JSON object")
+            yield key, self.value()
+            c = self.read()
+            if c == "}":
+                return
+            if c != ",":
+                raise ValueError("Malformed JSON object")
+
+
+def parseJSON(path) -> Iterator[Tuple[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        yield from JSONStream(f).iterobject()
+
+
+def parseMigaku(path) -> Iterator[Tuple[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        for item in JSONStream(f).iterarray():
+            yield item['term'], item['definition']
+
+
+def parseFreq(path) -> Iterator[Tuple[str, str]]:
+    "Frequency lists are stored as the rank of each word"
+    with open(path, encoding="utf-8") as f:
+        for i, word in enumerate(JSONStream(f).iterarray()):
+            yield word, str(i + 1)
+
+
+def parseMDX(path) -> Iterator[Tuple[str, str]]:
     mdx = MDX(path)
     stylesheet_lines = mdx.header[b'StyleSheet'].decode().splitlines()
     stylesheet_map = {}
@@ -71,9 +198,8 @@ def parseMDX(path) -> Dict[str, str]:
             number = int(line)
         else:
             stylesheet_map[number] = stylesheet_map.get(number, "") + line
-    newdict = {}  # This temporarily stores the new entries
-    i = 0
-    prev_headword = ""
+    prev_headword = None
+    prev_entry = ""
     for item in mdx.items():
         headword, entry = item
         headword = headword.decode()
@@ -86,27 +212,199 @@ def parseMDX(path) -> Dict[str, str]:
                 entry
             )
         entry = entry.replace("\n", "").replace("\r", "")
-        # Using newdict.get would become incredibly slow,
-        # here we exploit the fact that they are alphabetically ordered
+        # Records are alphabetically ordered, so all the records for
+        # a headword are consecutive and can be merged on the fly
         if prev_headword == headword:
-            newdict[headword] = newdict[headword] + entry
+            prev_entry += entry
         else:
-            newdict[headword] = entry
-        prev_headword = headword
-    return newdict
+            if prev_headword is not None:
+                yield prev_headword, prev_entry
+            prev_headword = headword
+            prev_entry = entry
+    if prev_headword is not None:
+        yield prev_headword, prev_entry
+
+
+def cleanDSLHeadword(headword: str) -> str:
+    "Remove the {unsorted parts} of a DSL headword"
+    if "{" in headword:
+        headword = re.sub(r'\{[^}]+\}', "", headword)
+    return headword
+
+
+def cleanDSLDefinition(definition: str) -> str:
+    definition = re.sub(r'(\<b\>\d+\.\</b\>)\s+\<br>', r'\1 ', definition)
+    return removeprefix(definition, "<br>")
 
 
-def parseDSL(path) -> Dict[str, str]:
+def parseDSL(path) -> Iterator[Tuple[str, str]]:
     r = Reader()
     r.open(path)
-    newdict = {}
     for headwords, definition in iter(r):
+        definition = cleanDSLDefinition(definition)
         for headword in headwords:
-            if "{" in headword:
-                headword = re.sub(r'\{[^}]+\}', "", headword)
-            definition = re.sub(r'(\<b\>\d+\.\</b\>)\s+\<br>', r'\1 ', definition)
-            newdict[headword] = removeprefix(definition, "<br>")
-    return newdict
+            yield cleanDSLHeadword(headword), definition
+    r.close()
+
+
+def detectDSLEncoding(head: bytes) -> Tuple[str, int]:
+    """
+    Guess the encoding of a DSL file from its first bytes.
+    Returns the codec and the length of the byte order mark to skip.
+    """
+    if head.startswith(b"\xff\xfe"):
+        return "utf-16-le", 2
+    if head.startswith(b"\xfe\xff"):
+        return "utf-16-be", 2
+    if head.startswith(b"\xef\xbb\xbf"):
+        return "utf-8", 3
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # The last character may just have been cut in half
+        if e.start < len(head) - 3:
+            return "utf-16-le", 0
+    return "utf-8", 0
+
+
+def scanDSL(path) -> Iterator[Tuple[List[str], int, int]]:
+    """
+    Yield the headwords of each article of a DSL file, along with the
+    offset and size in bytes of the article in the uncompressed file.
+    """
+    opener = gzip.open if path.endswith(".dz") else open
+    with opener(path, "rb") as f:
+        encoding, pos = detectDSLEncoding(f.read(4096))
+        f.seek(pos)
+        headwords: List[str] = []
+        start = end = 0
+        in_text = False
+        for line in io.TextIOWrapper(f, encoding=encoding, newline=""):
+            size = len(line.encode(encoding))
+            stripped = line.rstrip()
+            if not stripped:
+                pass
+            elif line[0] in " \t":
+                in_text = bool(headwords)
+                end = pos + size
+            elif stripped.startswith("#") and not headwords and not in_text:
+                pass  # header
+            else:
+                if in_text:
+                    yield headwords, start, end - start
+                    headwords = []
+                    in_text = False
+                if not headwords:
+                    start = pos
+                headwords.append(cleanDSLHeadword(stripped))
+            pos += size
+        if in_text:
+            yield headwords, start, end - start
+
+
+def renderDSLArticle(text: str) -> str:
+    "Convert a single raw DSL article, headwords included, to HTML"
+    r = Reader()
+    r.openLines(text.splitlines())
+    for headwords, definition in r:
+        return cleanDSLDefinition(definition)
+    return ""
+
+
+def readStarDictInfo(path) -> Dict[str, str]:
+    "Read the key=value pairs of a StarDict .ifo file"
+    info = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            key, sep, value = line.partition("=")
+            if sep:
+                info[key.strip()] = value.strip()
+    return info
+
+
+def openStarDictFile(path):
+    "Open a StarDict file, or its gzip/dictzip-compressed version"
+    if os.path.exists(path):
+        return open(path, "rb")
+    for ext in (".gz", ".dz"):
+        if os.path.exists(path + ext):
+            return gzip.open(path + ext, "rb")
+    raise FileNotFoundError(path)
+
+
+def iterStarDictIndex(f, offsetbits=32) -> Iterator[Tuple[str, int, int]]:
+    "Yield (headword, offset, size) for each record of an open .idx file"
+    return iterStarDictRecords(f, struct.Struct(">LL" if offsetbits == 32 else ">QL"))
+
+
+def iterStarDictRecords(f, cords: struct.Struct) -> Iterator[tuple]:
+    """
+    Yield the records of an open StarDict .idx or .syn file, each a
+    NUL-terminated word followed by the fixed-size fields in cords
+    """
+    buf = b""
+    pos = 0
+    while True:
+        end = buf.find(b"\0", pos)
+        if end == -1 or end + 1 + cords.size > len(buf):
+            more = f.read(1 << 16)
+            if not more:
+                return
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield (buf[pos:end].decode("utf-8"), *cords.unpack_from(buf, end + 1))
+        pos = end + 1 + cords.size
+
+
+def parseStarDict(path) -> Iterator[Tuple[str, str]]:
+    """
+    Stream entries from a StarDict dictionary given the path of its .ifo file.
+    Only the current record is kept in memory.
+    """
+    prefix = os.path.splitext(path)[0]
+    info = readStarDictInfo(prefix + ".ifo")
+    offsetbits = int(info.get("idxoffsetbits", 32))
+    xdxf = info.get("sametypesequence") == "x"
+    with openStarDictFile(prefix + ".idx") as idx, openStarDictFile(prefix + ".dict") as data:
+        prev_headword = None
+        prev_entry = ""
+        for headword, offset, size in iterStarDictIndex(idx, offsetbits):
+            data.seek(offset)
+            entry = data.read(size).decode("utf-8")
+            if xdxf:
+                entry = xdxf2html(entry)
+            # Same as in MDX, duplicate headwords are next to each other
+            if prev_headword == headword:
+                prev_entry += "\n\n" + entry
+            else:
+                if prev_headword is not None:
+                    yield prev_headword, prev_entry
+                prev_headword = headword
+                prev_entry = entry
+        if prev_headword is not None:
+            yield prev_headword, prev_entry
+
+
+def parseStarDictSynonyms(path) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (synonym, headword) pairs from the .syn file of a StarDict
+    dictionary, which often lists the inflected forms of headwords.
+    Yields nothing if the dictionary has no .syn file.
+    """
+    prefix = os.path.splitext(path)[0]
+    try:
+        syn = openStarDictFile(prefix + ".syn")
+    except FileNotFoundError:
+        return
+    info = readStarDictInfo(prefix + ".ifo")
+    with openStarDictFile(prefix + ".idx") as idx:
+        headwords = [headword for headword, _, _ in
+                     iterStarDictIndex(idx, int(info.get("idxoffsetbits", 32)))]
+    with syn:
+        for synonym, index in iterStarDictRecords(syn, struct.Struct(">L")):
+            if index < len(headwords):
+                yield synonym, headwords[index]
 
 
 # There is a str.removeprefix function, but it is implemented
@@ -118,19 +416,123 @@ def removeprefix(self: str, prefix: str, /) -> str:
         return self[:]
 
 
-def parseCSV(path) -> Dict[str, str]:
-    newdict = {}
+def parseCSV(path) -> Iterator[Tuple[str, str]]:
     with open(path, newline="") as csvfile:
         data = csv.reader(csvfile)
         for row in data:
-            newdict[row[0]] = row[1]
-    return newdict
+            yield row[0], row[1]
 
 
-def parseTSV(path) -> Dict[str, str]:
-    newdict = {}
+def parseTSV(path) -> Iterator[Tuple[str, str]]:
     with open(path, newline="") as csvfile:
         data = csv.reader(csvfile, delimiter="\t")
         for row in data:
-            newdict[row[0]] = row[1]
-    return newdict
+            yield row[0], row[1]
+
+
+def parseAudioLib(path) -> Iterator[Tuple[str, str]]:
+    "Audios are stored as a serialized json list of paths relative to the library"
+    d: Dict[str, List[str]] = {}
+    for root, dirs, files in os.walk(path):
+        for item in files:
+            relpath = os.path.relpath(os.path.join(root, item), path)
+            headword = os.path.basename(os.path.splitext(relpath)[0]).lower()
+            d.setdefault(headword, []).append(relpath)
+    for headword, items in d.items():
+        yield headword, json.dumps(items)
+
+
+def parseDictionary(path, dicttype) -> Iterator[Tuple[str, str]]:
+    "Stream (headword, definition) pairs from a dictionary of any supported format"
+    if dicttype == "stardict":
+        return parseStarDict(path)
+    elif dicttype == "json":
+        return parseJSON(path)
+    elif dicttype == "migaku":
+        return parseMigaku(path)
+    elif dicttype == "freq":
+        return parseFreq(path)
+    elif dicttype == "audiolib":
+        return parseAudioLib(path)
+    elif dicttype == "mdx":
+        return parseMDX(path)
+    elif dicttype == "dsl":
+        return parseDSL(path)
+    elif dicttype == "csv":
+        return parseCSV(path)
+    elif dicttype == "tsv":
+        return parseTSV(path)
+    raise NotImplementedError("Unsupported format")
+
+
+def sourceFiles(path, dicttype) -> List[str]:
+    "The files a dictionary is read from"
+    if dicttype == "stardict":
+        prefix = os.path.splitext(path)[0]
+        return [prefix + ".ifo"] + [
+            prefix + name + ext for name in (".idx", ".dict", ".syn") for ext in ("", ".gz", ".dz")
+            if os.path.exists(prefix + name + ext)]
+    return [path]
+
+
+def hashSource(path, dicttype, options: Dict) -> str:
+    """
+    Hash the contents of the files of a dictionary, together with the
+    options it is imported with. If neither changes, importing it again
+    gives the same result.
+    """
+    h = hashlib.blake2b(json.dumps(options, sort_keys=True).encode("utf-8"))
+    if dicttype == "audiolib":
+        # Only the names of the audio files are imported
+        for item in sorted(parseAudioLib(path)):
+            h.update(json.dumps(item).encode("utf-8"))
+        return h.hexdigest()
+    for fname in sourceFiles(path, dicttype):
+        h.update(os.path.basename(fname).encode("utf-8") + b"\0")
+        with open(fname, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def stampSource(path, dicttype, options: Dict) -> str:
+    """
+    Like hashSource(), but only from the sizes and modification times of
+    the files, which is quick enough to do on every import. If the stamp
+    of a dictionary did not change, neither did its hash.
+    """
+    if dicttype == "audiolib":
+        # Its hash only reads the names of the files anyway
+        return hashSource(path, dicttype, options)
+    h = hashlib.blake2b(json.dumps(options, sort_keys=True).encode("utf-8"))
+    for fname in sourceFiles(path, dicttype):
+        st = os.stat(fname)
+        h.update(f"{os.path.basename(fname)}\0{st.st_size}\0{st.st_mtime_ns}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+def spillDictionary(path, dicttype, spillpath) -> int:
+    """
+    Parse a dictionary into a spill file of pickled chunks of entries, to
+    be read back with readSpill(). This is run in worker processes, so
+    that several dictionaries can be parsed at once.
+    Return the number of entries.
+    """
+    count = 0
+    entries = parseDictionary(path, dicttype)
+    with open(spillpath, "wb") as f:
+        while chunk := list(islice(entries, SPILL_CHUNK_SIZE)):
+            pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+            count += len(chunk)
+    return count
+
+
+def readSpill(spillpath) -> Iterator[Tuple[str, str]]:
+    "Stream the entries of a spill file written by spillDictionary()"
+    with open(spillpath, "rb") as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            yield from chunk
@@ -1,5 +1,5 @@
 import json
-import unicodedata
+import math
 import simplemma
 import re
 import requests
@@ -14,7 +14,9 @@ from markdown import markdown
 from .db import *
 from .playsound import playsound
 from .forvo import *
-from .dictformats import removeprefix
+from .dictformats import removeprefix, parseStarDictSynonyms
+from .normalize import removeAccents, normalizeKey
+from .segment import SEGMENTED_LANGUAGES
 dictdb = LocalDictionary()
 
 gtrans_languages = ['af', 'sq', 'am', 'ar', 'hy', 'az', 'eu', 'be', 'bn',
@@ -41,6 +43,11 @@ simplemma_languages = [
     'pl', 'pt', 'ro', 'ru', 'sk', 'sl', 'sv', 'tr', 'uk', 'ur'
 ]
 pronunciation_sources = ["Forvo (all)", "Forvo (best)"]
+# Number of completions returned
+COMPLETE_LIMIT = 10
+# Number of headwords considered for completion, besides the most
+# frequent ones
+COMPLETE_SCAN = 200
 
 # On Windows frozen build, there is no pymorphy2 support for Russian due
 # to an issue with cxfreeze
@@ -52,45 +59,30 @@ except ValueError:
     morph = None
     pass
 
+# The lemmatization data of simplemma is only exposed by newer versions
+try:
+    from simplemma.strategies.dictionaries import DefaultDictionaryFactory
+except ImportError:
+    DefaultDictionaryFactory = None
+
 
 def preprocess_clipboard(s: str, lang: str) -> str:
     """
-    Pre-process string from clipboard before showing it
-    NOTE: originally intended for parsing JA and ZH, but
-    that feature has been removed for the time being due
-    to maintainence and dependency concerns.
+    Pre-process string from clipboard before showing it.
+    Chinese and Japanese are split into words with spaces, using the
+    headwords of the imported dictionaries of the language, once these
+    are loaded in the background.
     """
+    if lang in SEGMENTED_LANGUAGES:
+        if (segmenter := dictdb.getSegmenter(lang, wait=False)) is not None:
+            return segmenter.segment(s)
     return s
 
 
-def removeAccents(word):
-    #print("Removing accent marks from query ", word)
-    ACCENT_MAPPING = {
-        '́': '',
-        '̀': '',
-        'а́': 'а',
-        'а̀': 'а',
-        'е́': 'е',
-        'ѐ': 'е',
-        'и́': 'и',
-        'ѝ': 'и',
-        'о́': 'о',
-        'о̀': 'о',
-        'у́': 'у',
-        'у̀': 'у',
-        'ы́': 'ы',
-        'ы̀': 'ы',
-        'э́': 'э',
-        'э̀': 'э',
-        'ю́': 'ю',
-        '̀ю': 'ю',
-        'я́́': 'я',
-        'я̀': 'я',
-    }
-    word = unicodedata.normalize('NFKC', word)
-    for old, new in ACCENT_MAPPING.items():
-        word = word.replace(old, new)
-    return word
+def prepareSegmenter(lang: str):
+    "Start loading what preprocess_clipboard() needs for a language, if anything"
+    if lang in SEGMENTED_LANGUAGES:
+        dictdb.getSegmenter(lang, wait=False)
 
 
 def fmt_result(definitions):
@@ -199,6 +191,27 @@ def getAudio(word, language, dictionary="Forvo (all)", custom_dicts=[]) -> Optio
     return
 
 
+def lookupCandidates(word, language, lemmatize=True, local=True):
+    """
+    Forms of word to try, in order, when looking it up. Only local
+    dictionaries, where a miss costs no request, also get the word as it
+    was before lemmatization.
+    """
+    IS_UPPER = word[0].isupper()
+    if language == 'ru':
+        word = removeAccents(word)
+    original = word
+    if lemmatize:
+        word = lem_word(word, language)
+    # The lemmatizer would always turn words lowercase, which can cause
+    # lookups to fail if not recovered.
+    candidates = [word, word.capitalize()] if IS_UPPER else [word]
+    # The lemmatizer may also get it wrong
+    if local and original not in candidates:
+        candidates.append(original)
+    return candidates
+
+
 def lookupin(
         word,
         language,
@@ -208,40 +221,202 @@ def lookupin(
         gtrans_api="https://lingva.ml"):
     # Remove any punctuation other than a hyphen
     # @language is code
-    IS_UPPER = word[0].isupper()
-    if language == 'ru':
-        word = removeAccents(word)
-    if lemmatize:
-        word = lem_word(word, language)
-    # The lemmatizer would always turn words lowercase, which can cause
-    # lookups to fail if not recovered.
-    candidates = [word, word.capitalize()] if IS_UPPER else [word]
-    for word in candidates:
+    if lemmatize and dictionary not in dictionaries:
+        # Inflected forms indexed at import time spare the lemmatizer
+        if (found := dictdb.defineForms([word], language, dictionary).get(word)) is not None:
+            return {"word": found[0], "definition": found[1]}
+    candidates = lookupCandidates(word, language, lemmatize, dictionary not in dictionaries)
+    if dictionary not in dictionaries:
+        # Local dictionaries already ignore case and stress marks
+        candidates = dictdb.distinctCandidates(candidates, language, dictionary)
+    for candidate in candidates:
         try:
             if dictionary == "Wiktionary (English)":
-                item = wiktionary(word, language, lemmatize)
+                item = wiktionary(candidate, language, lemmatize)
                 item['definition'] = fmt_result(item['definition'])
                 return item
             elif dictionary == "Google Translate":
-                return googletranslate(word, language, gtrans_lang, gtrans_api)
+                return googletranslate(candidate, language, gtrans_lang, gtrans_api)
             else:
                 return {
-                    "word": word,
+                    "word": candidate,
                     "definition": dictdb.define(
-                        word,
+                        candidate,
                         language,
                         dictionary)}
         except BaseException:
             pass
+    if dictionary not in dictionaries:
+        if not lemmatize:
+            # Forms declared by the dictionary itself are still worth a try
+            if (found := dictdb.defineForms([word], language, dictionary).get(word)) is not None:
+                return {"word": found[0], "definition": found[1]}
     raise Exception("Word not found")
 
 
+def suggestions(word, language, dictionary) -> list:
+    "Headwords of a local dictionary that a word not found may be a misspelling of"
+    if dictionary in dictionaries:
+        return []
+    return dictdb.suggest(word, language, dictionary)
+
+
+def lookupin_many(
+        words,
+        language,
+        lemmatize=True,
+        dictionary="Wiktionary (English)",
+        gtrans_lang="en",
+        gtrans_api="https://lingva.ml"):
+    """
+    Look up many words at once. Local dictionaries are queried once for
+    all candidates of all words.
+    Return a dict of found words to items like those of lookupin(),
+    and a list of the words that were not found.
+    """
+    hits = {}
+    misses = []
+    if dictionary in dictionaries:
+        # Online sources can only be queried one word at a time
+        for word in dict.fromkeys(words):
+            try:
+                hits[word] = lookupin(word, language, lemmatize, dictionary, gtrans_lang, gtrans_api)
+            except Exception:
+                misses.append(word)
+        return hits, misses
+    words = list(dict.fromkeys(words))
+    if lemmatize:
+        for word, (headword, definition) in dictdb.defineForms(words, language, dictionary).items():
+            hits[word] = {"word": headword, "definition": definition}
+    candidates = {word: lookupCandidates(word, language, lemmatize) if word else []
+                  for word in words if word not in hits}
+    definitions = dictdb.define_many(
+        [c for cs in candidates.values() for c in cs], language, dictionary)
+    for word, cs in candidates.items():
+        for candidate in cs:
+            if candidate in definitions:
+                hits[word] = {"word": candidate, "definition": definitions[candidate]}
+                break
+        else:
+            misses.append(word)
+    if not lemmatize and misses:
+        for word, (headword, definition) in dictdb.defineForms(misses, language, dictionary).items():
+            hits[word] = {"word": headword, "definition": definition}
+        misses = [word for word in misses if word not in hits]
+    return hits, misses
+
+
+def lemmaForms(headwords, language):
+    """
+    Generate (form, headword) pairs for the inflected forms of headwords
+    known to the lemmatizer of language
+    """
+    if language == 'ru' and PYMORPHY_SUPPORT:
+        for headword in headwords:
+            for parse in morph.parse(headword):
+                if parse.normal_form == headword.lower():
+                    for form in parse.lexeme:
+                        yield form.word, headword
+    elif language in simplemma_languages and DefaultDictionaryFactory is not None:
+        keys = {normalizeKey(headword, language): headword for headword in headwords}
+        for form, lemma in DefaultDictionaryFactory().get_dictionary(language).items():
+            if (headword := keys.get(normalizeKey(lemma, language))) is not None:
+                yield form, headword
+
+
+# Grammatical terms that end glosses like "plural of cat" or
+# "third-person singular simple present indicative of go"
+form_terms = [
+    "form", "forms", "spelling", "plural", "singular", "dual", "tense",
+    "participle", "gerund", "infinitive", "supine", "preterite", "indicative",
+    "subjunctive", "imperative", "conditional", "inflection", "conjugation",
+    "declension", "degree", "comparative", "superlative", "case", "nominative",
+    "genitive", "dative", "accusative", "instrumental", "locative",
+    "prepositional", "ablative", "vocative", "masculine", "feminine", "neuter",
+    "diminutive", "augmentative", "contraction", "abbreviation",
+]
+re_form_of = re.compile(
+    r"^(?:\d+\.\s*)?(?:\([^()]*\)\s*)?(?:[\w’'-]+,?\s+){0,8}?(?:"
+    + "|".join(form_terms)
+    + r")\s+of\s+([\w’'-]+)\W*$",
+    re.IGNORECASE)
+re_sense_break = re.compile(r"<br\s*/?>|</?(?:li|p|div|ol|ul)\b[^>]*>|\n", re.IGNORECASE)
+re_tag = re.compile(r"<[^>]*>")
+
+
+def declaredForms(entries, language):
+    """
+    Generate (form, headword) pairs from entries whose definition says
+    which headword they are a form of, as in "plural of cat".
+    Only pairs pointing to a headword of the same entries are generated.
+    """
+    keys = set()
+    found = []
+    for headword, definition in entries:
+        keys.add(normalizeKey(headword, language))
+        for sense in re_sense_break.split(definition):
+            sense = " ".join(re_tag.sub(" ", sense).split())
+            if len(sense) < 200 and (m := re_form_of.match(sense)):
+                found.append((headword, m.group(1)))
+    for form, headword in found:
+        if normalizeKey(headword, language) in keys:
+            yield form, headword
+
+
+def indexForms(name, language, path=None, dicttype=None, progress=None, db=dictdb) -> int:
+    """
+    Record the inflected forms of the headwords of a local dictionary:
+    those known to the lemmatizer, those declared in its definitions and,
+    for StarDict dictionaries, those listed in the synonym file
+    """
+    count = db.addForms(
+        name, language, lemmaForms(db.headwords(name, language), language), progress)
+    count += db.addForms(
+        name, language, declaredForms(db.iterEntries(name, language), language), progress)
+    if dicttype == "stardict":
+        count += db.addForms(name, language, parseStarDictSynonyms(path), progress)
+    return count
+
+
 def getFreq(word, language, lemfreq, dictionary) -> (int, int):
     if lemfreq:
         word = lem_word(word, language)
-    freq = dictdb.define(word.lower(), language, dictionary)
-    max_freq = dictdb.countEntriesDict(dictionary)
-    return int(freq), int(max_freq)
+    ranks, max_freq = dictdb.getFreqTable(dictionary, language)
+    return ranks[normalizeKey(word, language)], max_freq
+
+
+def findPhrases(sentence, language, dictionary, ready=None) -> list:
+    """
+    Return the multi-word headwords of a local dictionary that occur in
+    sentence, as (start, end, headword) where sentence[start:end] is the
+    occurrence.
+    With ready, none are found until the phrases of the dictionary are
+    compiled in the background, after which ready() is called.
+    """
+    if dictdb.getDictInfo(dictionary, language) is None:
+        return []
+    matcher = dictdb.getPhraseMatcher(dictionary, language, ready is None, ready)
+    return matcher.find(sentence) if matcher is not None else []
+
+
+def complete(prefix, language, dictionary, freqname="<disabled>", limit=COMPLETE_LIMIT) -> list:
+    """
+    Return up to limit headwords of a local dictionary that start with
+    prefix, the most frequent first according to the frequency list
+    freqname, if any
+    """
+    # Headwords right after prefix in alphabetical order
+    words = dictdb.complete(prefix, language, dictionary, COMPLETE_SCAN)
+    if freqname == "<disabled>" or not words:
+        return words[:limit]
+    ranks, _ = dictdb.getFreqTable(freqname, language)
+    if len(words) == COMPLETE_SCAN:
+        # There may be more frequent ones further on
+        frequent = dictdb.getFrequentWithPrefix(freqname, language, prefix, limit)
+        words.extend(dictdb.define_many(frequent, language, dictionary))
+    words = sorted(
+        dict.fromkeys(words), key=lambda word: ranks.get(normalizeKey(word, language), math.inf))
+    return words[:limit]
 
 
 def getDictsForLang(lang: str, dicts: list):
@@ -3,11 +3,18 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from .dictionary import *
 from .tools import *
-from .dictformats import supported_dict_formats, dictinfo
+from .dictformats import supported_dict_formats, mountable_dict_formats, dictinfo
+from .importqueue import ImportJob, RemoveJob, RebuildJob, importQueue
 from bidict import bidict
 import json
 import os
 
+storage_options = bidict({
+    "db": "Database",
+    "mount": "Look up in place",
+    "compiled": "Compiled file",
+})
+
 
 class DictManager(QDialog):
     def __init__(self, parent):
@@ -16,10 +23,15 @@ class DictManager(QDialog):
         self.setWindowTitle("Manage Local Dictionaries")
         self.parent = parent
         self.resize(500, 400)
+        self.queue = importQueue()
         self.initWidgets()
         self.setupWidgets()
         self.refresh()
         self.showStats()
+        self.queue.started.connect(self.onJobStarted)
+        self.queue.progress.connect(self.progress_label.setText)
+        self.queue.finished.connect(self.onJobFinished)
+        self.onJobStarted(self.queue.current, len(self.queue.pending))
         # self.loadSettings()
         # self.setupAutosave()
 
@@ -38,10 +50,19 @@ class DictManager(QDialog):
         self.rebuild.setToolTip("""\
 This will regenerate the database containing dictionary entries.
 This program stores all dictionary entries in a single database to
-improve performance during lookups. The files must be in their original location
-to be reimported, otherwise this operation will fail.\
+improve performance during lookups. Only the dictionaries whose files or
+options changed since they were imported are imported again.
+The files must be in their original location to be reimported,
+otherwise this operation will fail.\
         """)
         self.rebuild.clicked.connect(self.rebuildDB)
+        self.progress_label = QLabel()
+        self.progress_bar = QProgressBar()
+        # The number of entries is not known in advance
+        self.progress_bar.setRange(0, 0)
+        self.cancel = QPushButton("Cancel")
+        self.cancel.setToolTip("Stop the current operation. Dictionaries are left as they were.")
+        self.cancel.clicked.connect(self.queue.cancel)
         self.bar = QStatusBar()
 
     def setupWidgets(self):
@@ -57,26 +78,27 @@ to be reimported, otherwise this operation will fail.\
         self.layout.addWidget(self.add_audio)
         self.layout.addWidget(self.remove)
         self.layout.addWidget(self.rebuild)
+        self.layout.addWidget(self.progress_label)
+        progress = QHBoxLayout()
+        progress.addWidget(self.progress_bar)
+        progress.addWidget(self.cancel)
+        self.layout.addLayout(progress)
         self.layout.addWidget(self.bar)
 
     def rebuildDB(self):
-        start = time.time()
-        dicts = json.loads(self.settings.value("custom_dicts", '[]'))
-        dictdb.purge()
-        n_dicts = len(dicts)
-        for (i, item) in enumerate(dicts):
-            try:
-                self.status(f"Rebuilding database: dictionary ({i+1}/{n_dicts})"
-                            ".. this can take a while.")
-                QCoreApplication.processEvents()
-                dictimport(item['path'], item['type'], item['lang'], item['name'])
-            except Exception as e:
-                print(e)
-
-        QMessageBox.information(self, "Database rebuilt",
-                                f"Database rebuilt in {format(time.time()-start, '.3f')} seconds.")
+        self.queue.add(RebuildJob())
+
+    def onJobStarted(self, job, waiting):
+        "Show the job being run, if any"
+        for widget in (self.progress_label, self.progress_bar, self.cancel):
+            widget.setVisible(job is not None)
+        if job is not None:
+            self.progress_label.setText(
+                job.title + ".." + (f" ({waiting} more waiting)" if waiting else ""))
+
+    def onJobFinished(self, message):
         self.refresh()
-        self.showStats()
+        self.showStats(message + " ")
 
     def onAdd(self):
         fdialog = QFileDialog()
@@ -106,11 +128,8 @@ to be reimported, otherwise this operation will fail.\
         dicts = json.loads(self.settings.value("custom_dicts", '[]'))
         if dicts == []:
             return
-        dictdelete(dicts[index.row()]['name'])
-        del dicts[index.row()]
-        self.settings.setValue("custom_dicts", json.dumps(dicts))
-        self.refresh()
-        self.showStats()
+        # Removed from custom_dicts once done
+        self.queue.add(RemoveJob(dicts[index.row()]['name']))
 
     def refresh(self):
         dicts = json.loads(self.settings.value("custom_dicts", '[]'))
@@ -119,7 +138,9 @@ to be reimported, otherwise this operation will fail.\
             treeitem = QTreeWidgetItem(
                 [
                     item['name'],
-                    supported_dict_formats[item['type']],
+                    supported_dict_formats[item['type']]
+                    + (f" ({storage_options[item['storage']].lower()})"
+                       if item.get('storage', "db") != "db" else ""),
                     langcodes[item['lang']],
                     str(dictdb.countEntriesDict(item['name']))
                 ]
@@ -135,15 +156,19 @@ to be reimported, otherwise this operation will fail.\
         return QDateTime.currentDateTime().toString('[hh:mm:ss]')
 
     def closeEvent(self, event):
+        # The queue goes on after the dialog is closed
+        self.queue.started.disconnect(self.onJobStarted)
+        self.queue.progress.disconnect(self.progress_label.setText)
+        self.queue.finished.disconnect(self.onJobFinished)
         self.parent.loadDictionaries()
         self.parent.loadFreqSources()
         self.parent.loadAudioDictionaries()
         event.accept()
 
-    def showStats(self):
+    def showStats(self, msg=""):
         n_dicts = dictdb.countDicts()
         n_entries = dictdb.countEntries()
-        self.status(f"Total: {n_dicts} dictionaries, {n_entries} entries.", t=0)
+        self.status(f"{msg}Total: {n_dicts} dictionaries, {n_entries} entries.", t=0)
         # t=0 means it will not disappear
 
 
@@ -187,6 +212,35 @@ class AddDictDialog(QDialog):
         self.lang.addItems(langs_supported.values())
         self.lang.setCurrentText(
             langcodes[self.settings.value("target_language")])
+        self.storage = QComboBox()
+        self.storage.setToolTip(
+            "Database: copy all entries into the dictionary database.\n"
+            "Look up in place (StarDict and DSL only): read definitions directly from\n"
+            "the dictionary files. Adding the dictionary is much faster and takes almost\n"
+            "no disk space, but the files must stay where they are.\n"
+            "Compiled file: store entries in a compact read-only file that opens instantly.")
+        self.compress = QCheckBox("Compress definitions")
+        self.compress.setToolTip(
+            "Store definitions compressed in the database. Takes much less disk space,\n"
+            "at the cost of slightly slower lookups.")
+        self.forms = QCheckBox("Index inflected forms")
+        self.forms.setToolTip(
+            "Record the inflected forms of every headword when adding the dictionary,\n"
+            "so that they can be looked up without running the lemmatizer.\n"
+            "This includes forms that the dictionary itself lists, such as \"plural of ...\".\n"
+            "Adding the dictionary takes longer.")
+        self.search = QCheckBox("Enable full-text search")
+        self.search.setToolTip(
+            "Index the text of all definitions, so that the dictionary can be searched\n"
+            "for headwords whose definitions contain some words (reverse lookup).\n"
+            "Takes additional disk space.")
+        self.typos = QCheckBox("Suggest corrections")
+        self.typos.setToolTip(
+            "When a word is not found, suggest the closest headwords within two edits.\n"
+            "Takes additional disk space.")
+        self.type.currentTextChanged.connect(self.updateStorageOptions)
+        self.storage.currentTextChanged.connect(self.updateCompressOption)
+        self.updateStorageOptions()
         self.commit_button = QPushButton("Add")
         self.commit_button.clicked.connect(self.commit)
 
@@ -195,8 +249,27 @@ class AddDictDialog(QDialog):
         self.layout.addRow(QLabel("Name"), self.name)
         self.layout.addRow(QLabel("Type"), self.type)
         self.layout.addRow(QLabel("Language"), self.lang)
+        self.layout.addRow(QLabel("Storage"), self.storage)
+        self.layout.addRow(self.compress)
+        self.layout.addRow(self.forms)
+        self.layout.addRow(self.search)
+        self.layout.addRow(self.typos)
         self.layout.addRow(self.commit_button)
 
+    def updateStorageOptions(self):
+        current = self.storage.currentText()
+        self.storage.clear()
+        self.storage.addItem(storage_options["db"])
+        if supported_dict_formats.inverse[self.type.currentText()] in mountable_dict_formats:
+            self.storage.addItem(storage_options["mount"])
+        self.storage.addItem(storage_options["compiled"])
+        if current:
+            self.storage.setCurrentText(current)
+
+    def updateCompressOption(self):
+        self.compress.setEnabled(
+            self.storage.currentText() == storage_options["db"])
+
     def commit(self):
         "Give it a name, then add dictionary"
         name = self.name.text()
@@ -205,6 +278,7 @@ class AddDictDialog(QDialog):
         existing_names = getDictsForLang(lang, dicts)\
             + getFreqlistsForLang(lang, dicts)\
             + getAudioDictsForLang(lang, dicts)\
+            + self.parent.queue.names()\
             + ['wikt-en', 'gtrans', '####METAINFO']
         if name.lower() in [n.lower() for n in existing_names]:
             # Name conflict!!
@@ -216,21 +290,18 @@ class AddDictDialog(QDialog):
             )
             return
 
-        dictimport(
-            self.path,
-            supported_dict_formats.inverse[self.type.currentText()],
-            lang,
-            self.name.text())
-        dicts.append({"name": self.name.text(),
-                      "type": supported_dict_formats.inverse[self.type.currentText()],
-                      "path": self.path,
-                      "lang": langcodes.inverse[self.lang.currentText()],
-                      })
-        self.settings.setValue("custom_dicts", json.dumps(dicts))
-        self.parent.status(f"Importing {self.name.text()} to database..")
-        self.parent.refresh()
-        self.parent.status("Importing done.")
-        self.parent.showStats()
+        # Added to custom_dicts once imported
+        self.parent.queue.add(ImportJob({
+            "name": self.name.text(),
+            "type": supported_dict_formats.inverse[self.type.currentText()],
+            "path": self.path,
+            "lang": langcodes.inverse[self.lang.currentText()],
+            "storage": storage_options.inverse[self.storage.currentText()],
+            "compress": self.compress.isEnabled() and self.compress.isChecked(),
+            "forms": self.forms.isChecked(),
+            "search": self.search.isChecked(),
+            "typos": self.typos.isChecked(),
+        }))
         self.close()
 
     def warn(self, text):
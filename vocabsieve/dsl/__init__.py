@@ -22,6 +22,7 @@ import re
 import html
 import html.entities
 from xml.sax.saxutils import escape, quoteattr
+from typing import Iterable
 
 from . import layer
 from . import tag
@@ -410,6 +411,14 @@ class Reader(object):
                 break
             self.processHeaderLine(line)
 
+    def openLines(self, lines: "Iterable[str]") -> None:
+        """
+        Read entries from lines of DSL text rather than from a file,
+        such as a single article. The text must have no header.
+        """
+        self._file = (line for line in lines)
+        self._bufferLine = ""
+
     def detectEncoding(self):
         for testEncoding in ("utf-8", "utf-16"):
             with compressionOpen(
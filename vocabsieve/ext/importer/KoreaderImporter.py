@@ -190,12 +190,15 @@ class KoreaderImporter(QDialog):
         self.layout.addRow(self.definition_count_label, self.anki_button)
 
         count = 0
+        # Remove punctuations
+        words = [re.sub('[\\?\\.!«»…,()\\[\\]]*', "", term) for term in self.lookup_terms]
+        items = self.parent.lookup_many(
+            [word for word, sent in zip(words, self.sents) if sent])
         for i in range(len(self.lookup_terms)):
-            # Remove punctuations
-            word = re.sub('[\\?\\.!«»…,()\\[\\]]*', "", self.lookup_terms[i])
+            word = words[i]
 
             if self.sents[i]:
-                item = self.parent.lookup(word, record=False)
+                item = items[word]
                 if not item['definition'].startswith("<b>Definition for"):
                     count += 1
                     self.words.append(item['word'])
@@ -6,6 +6,8 @@ from markdown import markdown
 import os
 import re
 from .utils import *
+from ...schema import migrate
+from ...connection import openDatabase
 from PyQt5.QtCore import QStandardPaths, QCoreApplication, QObject
 from pathlib import Path
 # The following import is to avoid cxfreeze error
@@ -29,6 +31,10 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['SECRET_KEY'] = "abc"
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{datapath}/reader.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+readerdb = openDatabase(os.path.join(datapath, "reader.db"))
+# Connections are set up like those of the other databases, and pooled
+# by SQLAlchemy
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"creator": readerdb.open}
 db = SQLAlchemy(app)
 
 
@@ -47,7 +53,14 @@ class Text(db.Model):  # type: ignore[name-defined]
         return f"Text(ID={self.id}, Title={self.title})"
 
 
-db.create_all()
+def createTables():
+    with app.app_context():
+        db.create_all()
+
+
+# Changes to the schema of reader.db, in the order they were made
+migrations = [createTables]
+migrate(readerdb, migrations)
 
 
 class ReaderServer(QObject):
@@ -0,0 +1,72 @@
+"""
+Approximate matching of headwords, after the symmetric deletion algorithm
+of SymSpell. A word and a misspelling of it within a small edit distance
+can both be turned into a common string by deleting characters only, so
+the deletions of every headword are indexed, and the deletions of a query
+are looked up in that index. Candidates are then verified one by one.
+"""
+from typing import List, Set
+
+# Largest edit distance that is corrected
+MAX_DISTANCE = 2
+# Only the start of words is indexed, which bounds the number of variants
+# of each headword. Candidates are verified on the whole word.
+PREFIX_LENGTH = 7
+
+
+def deletions(word: str, distance=MAX_DISTANCE, prefix=PREFIX_LENGTH) -> Set[str]:
+    "The strings obtained by deleting up to distance characters from the start of word"
+    res = {word[:prefix]}
+    frontier = res
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        res = res | frontier
+    return res
+
+
+def editDistance(a: str, b: str, limit=MAX_DISTANCE) -> int:
+    """
+    Edit distance between a and b, counting transpositions of adjacent
+    characters as one edit (optimal string alignment).
+    Returns limit + 1 as soon as it is known to be larger than limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Common ends never need to be edited. Candidates usually share most
+    # of their beginning with the query, so this leaves little to compare.
+    n = min(len(a), len(b))
+    start = 0
+    while start < n and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < n - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+    big = limit + 1
+    before: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        # Cells further than limit from the diagonal cannot be within limit
+        lo = i - limit if i > limit else 1
+        hi = i + limit if i + limit < len(b) else len(b)
+        cur = [big] * (len(b) + 1)
+        if i <= limit:
+            cur[0] = i
+        left = rowmin = cur[lo - 1]
+        for j in range(lo, hi + 1):
+            d = prev[j - 1] + (a[i - 1] != b[j - 1])
+            if prev[j] + 1 < d:
+                d = prev[j] + 1
+            if left + 1 < d:
+                d = left + 1
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]
+                    and before[j - 2] + 1 < d):
+                d = before[j - 2] + 1
+            cur[j] = left = d
+            if d < rowmin:
+                rowmin = d
+        if rowmin > limit:
+            return big
+        before, prev = prev, cur
+    return min(prev[-1], big)
@@ -0,0 +1,168 @@
+from PyQt5.QtCore import *
+from .tools import *
+import json
+
+
+class ImportJob():
+    "Import a dictionary, then add it to custom_dicts"
+
+    def __init__(self, item):
+        self.item = item
+        self.title = f"Importing {item['name']}"
+
+    def run(self, db, progress):
+        item = self.item
+        dictimport(item['path'], item['type'], item['lang'], item['name'],
+                   lambda n: progress(f"{self.title}: {n} entries"),
+                   item['storage'], item['compress'], item['forms'], item['search'], item['typos'],
+                   db=db)
+        return f"Imported {item['name']}."
+
+    def done(self, dicts):
+        dicts.append(self.item)
+
+
+class RemoveJob():
+    "Delete a dictionary, then remove it from custom_dicts"
+
+    def __init__(self, name):
+        self.name = name
+        self.title = f"Removing {name}"
+
+    def run(self, db, progress):
+        dictdelete(self.name, db)
+        # Off the GUI thread and without blocking lookups, so there is no
+        # need to leave it to the next rebuild
+        db.collectGarbage()
+        return f"Removed {self.name}."
+
+    def done(self, dicts):
+        dicts[:] = [item for item in dicts if item['name'] != self.name]
+
+
+class RebuildJob():
+    "Bring the dictionary database in line with custom_dicts"
+    title = "Rebuilding database"
+
+    def run(self, db, progress):
+        start = time.time()
+        dicts = json.loads(QSettings().value("custom_dicts", '[]'))
+        imported, unchanged, failed = dictrebuild(
+            dicts, lambda msg: progress(f"{self.title}: {msg}"), db)
+        message = (f"Database rebuilt in {format(time.time() - start, '.3f')} seconds: "
+                   f"{imported} dictionaries imported, {unchanged} unchanged")
+        if failed:
+            message += f", {len(failed)} failed ({', '.join(failed)})"
+        return message + "."
+
+    def done(self, dicts):
+        pass
+
+
+class ImportWorker(QObject):
+    "Runs jobs in a thread of its own, with a connection of its own"
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(object, str, bool)
+
+    def __init__(self):
+        super().__init__()
+        self.db = None
+        self.cancelled = False
+
+    def run(self, job):
+        if self.db is None:
+            self.db = LocalDictionary()
+        self.progress.emit(job.title + "..")
+        try:
+            message = job.run(self.db, self.report)
+            self.finished.emit(job, message, True)
+        except ImportCancelled:
+            self.finished.emit(job, f"{job.title}: cancelled.", False)
+        except Exception as e:
+            self.finished.emit(job, f"{job.title}: failed: {e}", False)
+
+    def report(self, message):
+        "Progress callback of jobs, which is where they are cancelled"
+        if self.cancelled:
+            raise ImportCancelled()
+        self.progress.emit(message)
+
+
+class ImportQueue(QObject):
+    """
+    Changes to dictionaries, run one after another in the background so
+    that lookups go on. Their effects on custom_dicts are only recorded
+    once they succeed.
+    """
+    submit = pyqtSignal(object)
+    # Job being run, or None when the queue is empty, and the number of
+    # those waiting
+    started = pyqtSignal(object, int)
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(str)
+
+    def __init__(self):
+        super().__init__()
+        self.settings = QSettings()
+        self.pending = []
+        self.current = None
+        self.thread = QThread()
+        self.worker = ImportWorker()
+        self.worker.moveToThread(self.thread)
+        self.submit.connect(self.worker.run)
+        self.worker.progress.connect(self.progress)
+        self.worker.finished.connect(self.onFinished)
+        QCoreApplication.instance().aboutToQuit.connect(self.shutdown)
+        self.thread.start()
+
+    def add(self, job):
+        self.pending.append(job)
+        if self.current is None:
+            self.next()
+        else:
+            self.started.emit(self.current, len(self.pending))
+
+    def names(self):
+        "Names of the dictionaries waiting to be imported"
+        return [job.item['name'] for job in self.pending + [self.current]
+                if isinstance(job, ImportJob)]
+
+    def next(self):
+        self.current = self.pending.pop(0) if self.pending else None
+        self.started.emit(self.current, len(self.pending))
+        if self.current is not None:
+            # Here rather than when the worker starts it, so that the job
+            # can be cancelled before then
+            self.worker.cancelled = False
+            self.submit.emit(self.current)
+
+    def cancel(self):
+        "Stop the job being run. It leaves no trace of itself."
+        self.worker.cancelled = True
+
+    def onFinished(self, job, message, success):
+        if success:
+            dicts = json.loads(self.settings.value("custom_dicts", '[]'))
+            job.done(dicts)
+            self.settings.setValue("custom_dicts", json.dumps(dicts))
+        dictdb.reload()
+        prepareSegmenter(self.settings.value("target_language", "en"))
+        self.finished.emit(message)
+        self.next()
+
+    def shutdown(self):
+        self.pending.clear()
+        self.cancel()
+        self.thread.quit()
+        self.thread.wait()
+
+
+_queue = None
+
+
+def importQueue() -> ImportQueue:
+    "The queue of dictionary jobs, which outlives the dialogs that add to it"
+    global _queue
+    if _queue is None:
+        _queue = ImportQueue()
+    return _queue
@@ -1,4 +1,5 @@
 import os
+import multiprocessing
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.Qt import QDesktopServices, QUrl
@@ -22,6 +23,7 @@ from .api import LanguageServer
 from . import __version__
 from .ext.reader import ReaderServer
 from .ext.importer import KindleImporter, KoreaderImporter
+from .search import SearchDialog
 import sys
 import importlib
 import functools
@@ -43,6 +45,8 @@ if platform.system() == "Darwin":
     MOD = "Cmd"
 else:
     MOD = "Ctrl"
+# Milliseconds without typing in the sentence box before its phrases are listed
+PHRASES_DELAY = 300
 
 
 @functools.lru_cache()
@@ -78,6 +82,9 @@ class MyTextEdit(QTextEdit):
 
 
 class DictionaryWindow(QMainWindow):
+    # Emitted from the background once the phrases of a dictionary are compiled
+    phrasesReady = pyqtSignal()
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("VocabSieve" + os.environ.get("VOCABSIEVE_DEBUG", ""))
@@ -85,6 +92,8 @@ class DictionaryWindow(QMainWindow):
         self.widget = QWidget()
         self.settings = QSettings()
         self.rec = Record()
+        # Lookups and notes are written behind, so save what is left
+        QCoreApplication.instance().aboutToQuit.connect(self.rec.close)
         self.setCentralWidget(self.widget)
         self.previousWord = ""
         self.audio_path = ""
@@ -181,8 +190,21 @@ class DictionaryWindow(QMainWindow):
             "Sentence copied to the clipboard will show up here.")
         self.sentence.setMinimumHeight(50)
         #self.sentence.setMaximumHeight(300)
+        self.phrases = QComboBox()
+        self.phrases.setToolTip(
+            "Expressions of several words from the dictionary that occur in the sentence.\n"
+            "Select one to look it up.")
+        self.phrases.addItem("No phrases in sentence")
+        self.phrases.setEnabled(False)
         self.word = QLineEdit()
         self.word.setPlaceholderText("Word will appear here when looked up.")
+        self.word_completions = QStringListModel()
+        self.word_completer = QCompleter(self.word_completions, self)
+        self.word_completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.word.setCompleter(self.word_completer)
+        self.word.textEdited.connect(self.updateCompletions)
+        self.word_completer.activated[str].connect(
+            lambda word: self.lookupSet(word, False))
         self.definition = MyTextEdit()
         self.definition.setMinimumHeight(70)
         #self.definition.setMaximumHeight(1800)
@@ -277,47 +299,48 @@ class DictionaryWindow(QMainWindow):
         self.layout.addWidget(self.image_viewer, 0, 2, 3, 1)
         self.layout.addWidget(self.sentence, 3, 0, 1, 3)
         self.layout.setRowStretch(3, 1)
+        self.layout.addWidget(self.phrases, 4, 0, 1, 3)
         self.layout.addWidget(
-            QLabel("<h3 style=\"font-weight: normal;\">Word</h3>"), 4, 0)
+            QLabel("<h3 style=\"font-weight: normal;\">Word</h3>"), 5, 0)
 
         if self.settings.value("lemmatization", True, type=bool):
-            self.layout.addWidget(self.lookup_button, 4, 1)
-            self.layout.addWidget(self.lookup_exact_button, 4, 2)
+            self.layout.addWidget(self.lookup_button, 5, 1)
+            self.layout.addWidget(self.lookup_exact_button, 5, 2)
         else:
-            self.layout.addWidget(self.lookup_button, 4, 1, 1, 2)
+            self.layout.addWidget(self.lookup_button, 5, 1, 1, 2)
 
         self.layout.addWidget(
-            QLabel("<h3 style=\"font-weight: normal;\">Definition</h3>"), 6, 0)
-        self.layout.addWidget(self.freq_display, 6, 1)
-        self.layout.addWidget(self.web_button, 6, 2)
-        self.layout.addWidget(self.word, 5, 0, 1, 3)
-        self.layout.setRowStretch(7, 2)
-        self.layout.setRowStretch(9, 2)
+            QLabel("<h3 style=\"font-weight: normal;\">Definition</h3>"), 7, 0)
+        self.layout.addWidget(self.freq_display, 7, 1)
+        self.layout.addWidget(self.web_button, 7, 2)
+        self.layout.addWidget(self.word, 6, 0, 1, 3)
+        self.layout.setRowStretch(8, 2)
+        self.layout.setRowStretch(10, 2)
         if self.settings.value("dict_source2", "<disabled>") != "<disabled>":
-            self.layout.addWidget(self.definition, 7, 0, 2, 3)
-            self.layout.addWidget(self.definition2, 9, 0, 2, 3)
+            self.layout.addWidget(self.definition, 8, 0, 2, 3)
+            self.layout.addWidget(self.definition2, 10, 0, 2, 3)
         else:
-            self.layout.addWidget(self.definition, 7, 0, 4, 3)
+            self.layout.addWidget(self.definition, 8, 0, 4, 3)
 
         self.layout.addWidget(
             QLabel("<h3 style=\"font-weight: normal;\">Pronunciation</h3>"),
-            11,
+            12,
             0,
             1,
             3)
-        self.layout.addWidget(self.audio_selector, 12, 0, 1, 3)
-        self.layout.setRowStretch(12, 1)
+        self.layout.addWidget(self.audio_selector, 13, 0, 1, 3)
+        self.layout.setRowStretch(13, 1)
         self.layout.addWidget(
             QLabel("<h3 style=\"font-weight: normal;\">Additional tags</h3>"),
-            13,
+            14,
             0,
             1,
             3)
 
-        self.layout.addWidget(self.tags, 14, 0, 1, 3)
+        self.layout.addWidget(self.tags, 15, 0, 1, 3)
 
-        self.layout.addWidget(self.toanki_button, 15, 0, 1, 3)
-        self.layout.addWidget(self.config_button, 16, 0, 1, 3)
+        self.layout.addWidget(self.toanki_button, 16, 0, 1, 3)
+        self.layout.addWidget(self.config_button, 17, 0, 1, 3)
 
 
     def setupButtons(self):
@@ -332,6 +355,13 @@ class DictionaryWindow(QMainWindow):
         self.read_button.clicked.connect(lambda: self.clipboardChanged(True))
 
         self.sentence.textChanged.connect(self.updateAnkiButtonState)
+        self.phrases_timer = QTimer()
+        self.phrases_timer.setSingleShot(True)
+        self.phrases_timer.setInterval(PHRASES_DELAY)
+        self.phrases_timer.timeout.connect(self.updatePhrases)
+        self.sentence.textChanged.connect(self.phrases_timer.start)
+        self.phrasesReady.connect(self.updatePhrases)
+        self.phrases.activated[int].connect(self.onPhrase)
 
         self.bar.addPermanentWidget(self.stats_label)
 
@@ -340,6 +370,8 @@ class DictionaryWindow(QMainWindow):
         self.menu.addAction(self.open_reader_action)
         if not self.settings.value("reader_enabled", True, type=bool):
             self.open_reader_action.setEnabled(False)
+        self.search_action = QAction("&Search")
+        self.menu.addAction(self.search_action)
         importmenu = self.menu.addMenu("&Import")
         exportmenu = self.menu.addMenu("&Export")
         helpmenu = self.menu.addMenu("&Help")
@@ -357,6 +389,7 @@ class DictionaryWindow(QMainWindow):
         self.help_action.triggered.connect(self.onHelp)
         self.about_action.triggered.connect(self.onAbout)
         self.open_reader_action.triggered.connect(self.onReaderOpen)
+        self.search_action.triggered.connect(self.onSearch)
         self.import_koreader_action.triggered.connect(self.importkoreader)
         self.import_kindle_action.triggered.connect(self.importkindle)
         self.export_notes_csv_action.triggered.connect(self.exportNotes)
@@ -437,6 +470,7 @@ class DictionaryWindow(QMainWindow):
         self.layout.addWidget(
             QLabel("<h3 style=\"font-weight: normal;\">Sentence</h3>"), 1, 0)
         self.layout.addWidget(self.freq_display, 0, 2)
+        self.layout.addWidget(self.phrases, 6, 0)
         self.layout.addWidget(self.read_button, 6, 1)
 
         self.layout.addWidget(self.sentence, 2, 0, 3, 2)
@@ -576,6 +610,39 @@ class DictionaryWindow(QMainWindow):
         url = f"http://{self.settings.value('reader_host', '127.0.0.1', type=str)}:{self.settings.value('reader_port', '39285', type=str)}"
         QDesktopServices.openUrl(QUrl(url))
 
+    def onSearch(self):
+        SearchDialog(self).exec()
+
+    def updateCompletions(self, prefix):
+        "Complete the word being typed from the headwords of the current dictionary"
+        self.word_completions.setStringList(complete(
+            prefix,
+            self.settings.value("target_language", "en"),
+            self.settings.value("dict_source", "Wiktionary (English)"),
+            self.settings.value("freq_source", "<disabled>")))
+
+    def updatePhrases(self):
+        "List the phrases of the current dictionaries that occur in the sentence"
+        sentence = self.sentence.toPlainText()
+        language = self.settings.value("target_language", "en")
+        found = {}
+        for dictname in (self.settings.value("dict_source", "Wiktionary (English)"),
+                         self.settings.value("dict_source2", "<disabled>")):
+            for start, end, _ in findPhrases(sentence, language, dictname, self.phrasesReady.emit):
+                # As they are written, so that they can be bolded
+                found.setdefault(sentence[start:end].replace("_", ""))
+        self.phrases.clear()
+        if found:
+            self.phrases.addItem(f"Phrases in sentence ({len(found)})")
+            self.phrases.addItems(found)
+        else:
+            self.phrases.addItem("No phrases in sentence")
+        self.phrases.setEnabled(bool(found))
+
+    def onPhrase(self, index):
+        if index > 0:
+            self.lookupSet(self.phrases.itemText(index), False)
+
     def lookupClicked(self, use_lemmatize=True):
         target = self.getCurrentWord()
         self.updateAnkiButtonState()
@@ -768,7 +835,7 @@ class DictionaryWindow(QMainWindow):
             try:
                 freq, max_freq = getFreq(word, language, lemfreq, freqname)
                 freq_found = True
-            except TypeError:
+            except KeyError:
                 pass
 
             if freq_found:
@@ -806,9 +873,12 @@ class DictionaryWindow(QMainWindow):
                 self.rec.recordLookup(
                     word, None, TL, lemmatize, dictname, False)
                 self.updateAnkiButtonState(True)
+            # Local dictionaries indexed for typos may know what was meant
+            suggested = suggestions(word, language, dictname)
             item = {
                 "word": word,
-                "definition": failed_lookup(word, self.settings)
+                "definition": failed_lookup(word, self.settings, suggested),
+                "suggestions": suggested
             }
             return item
         dict2name = self.settings.value("dict_source2", "<disabled>")
@@ -836,6 +906,41 @@ class DictionaryWindow(QMainWindow):
             'definition': item['definition'],
             'definition2': item2['definition']}
 
+    def lookup_many(self, words, use_lemmatize=True):
+        """
+        Look up many words at once without recording them, as lookup() would
+        with record=False. Return a dict of each word to its item.
+        """
+        language = self.settings.value("target_language", "en")
+        lemmatize = use_lemmatize and self.settings.value(
+            "lemmatization", True, type=bool)
+        gtrans_lang = self.settings.value("gtrans_lang", "en")
+        gtrans_api = self.settings.value("gtrans_api", "https://lingva.ml")
+        dictname = self.settings.value("dict_source", "Wiktionary (English)")
+        dict2name = self.settings.value("dict_source2", "<disabled>")
+        cleaned = {word: re.sub('[«»…,()\\[\\]_]*', "", word) for word in words}
+        hits, _ = lookupin_many(
+            cleaned.values(), language, lemmatize, dictname, gtrans_lang, gtrans_api)
+        hits2 = {}
+        if dict2name != "<disabled>":
+            hits2, _ = lookupin_many(
+                hits.keys(), language, lemmatize, dict2name, gtrans_lang, gtrans_api)
+        items = {}
+        for word, clean in cleaned.items():
+            if clean not in hits:
+                items[word] = {
+                    "word": clean,
+                    "definition": failed_lookup(clean, self.settings)
+                }
+            elif clean not in hits2:
+                items[word] = hits[clean]
+            else:
+                items[word] = {
+                    "word": hits[clean]['word'],
+                    'definition': hits[clean]['definition'],
+                    'definition2': hits2[clean]['definition']}
+        return items
+
     def createNote(self):
         sentence = self.sentence.toPlainText().replace("\n", "<br>")
         if self.settings.value("bold_word", True, type=bool):
@@ -843,7 +948,12 @@ class DictionaryWindow(QMainWindow):
                 r"__([ \w]+)__",
                 r"<strong>\1</strong>",
                 sentence)
-        if self.settings.value("remove_spaces", False, type=bool):
+        # Spaces were inserted between the words of languages written
+        # without them
+        if self.settings.value(
+                "remove_spaces",
+                self.settings.value("target_language", "en") in SEGMENTED_LANGUAGES,
+                type=bool):
             sentence = re.sub("\\s", "", sentence)
         tags = (self.settings.value("tags", "vocabsieve").strip() + " " + self.tags.text().strip()).split(" ")
         word = self.word.text()
@@ -993,10 +1103,17 @@ class DictionaryWindow(QMainWindow):
         msg.exec()
 
     def initTimer(self):
-        self.showStats()
+        "Keep the counts of today up to date as lookups and notes are recorded"
+        self.rec.recorded.connect(self.showStats)
         self.timer = QTimer()
-        self.timer.timeout.connect(self.showStats)
-        self.timer.start(2000)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.onNewDay)
+        self.onNewDay()
+
+    def onNewDay(self):
+        self.showStats()
+        # The counts start over at midnight
+        self.timer.start(QTime.currentTime().msecsTo(QTime(23, 59, 59, 999)) + 1000)
 
     def showStats(self):
         lookups = self.rec.countLookupsToday()
@@ -1100,8 +1217,13 @@ If you find this tool useful, you can give it a star on Github and tell others a
 
 
 def main():
+    # Dictionaries are parsed in worker processes when rebuilding
+    multiprocessing.freeze_support()
+    dictdb.removeStale()
     app = QApplication(sys.argv)
     w = DictionaryWindow()
+    # Ready before the first sentence arrives, if there is time
+    prepareSegmenter(w.settings.value("target_language", "en"))
 
     w.show()
     sys.exit(app.exec())
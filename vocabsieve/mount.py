@@ -0,0 +1,291 @@
+"""
+Look up StarDict and DSL dictionaries in place, without copying their
+entries into the database. Only a headword index is kept on the side;
+definitions are read straight from the original files.
+"""
+import os
+import mmap
+import gzip
+import shutil
+import struct
+import zlib
+from array import array
+from typing import Callable, Iterator, List, Optional, Tuple
+from .dictformats import (
+    readStarDictInfo, scanDSL, detectDSLEncoding, renderDSLArticle
+)
+from .xdxftransform import xdxf2html
+
+# Number of inflated dictzip chunks kept in memory per file
+CHUNK_CACHE_SIZE = 32
+
+
+def mapfile(path):
+    "Memory-map a whole file read-only"
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PlainFile():
+    "Random access to an uncompressed file"
+
+    def __init__(self, path):
+        self.data = mapfile(path)
+
+    def read(self, offset: int, size: int) -> bytes:
+        return self.data[offset:offset + size]
+
+
+class DictZipFile():
+    """
+    Random access to a dictzip (.dz) file.
+    dictzip is gzip with the deflate stream flushed at fixed intervals and
+    the compressed size of each chunk recorded in the header, so any part
+    of the uncompressed data can be read by inflating only the chunks
+    that contain it.
+    """
+
+    def __init__(self, path):
+        self.data = data = mapfile(path)
+        if data[:3] != b"\x1f\x8b\x08":
+            raise ValueError(f"{path} is not a gzip file")
+        flags = data[3]
+        pos = 10
+        sizes = None
+        if flags & 4:  # FEXTRA
+            xlen, = struct.unpack_from("<H", data, pos)
+            pos += 2
+            end = pos + xlen
+            while pos + 4 <= end:
+                length, = struct.unpack_from("<H", data, pos + 2)
+                if data[pos:pos + 2] == b"RA":
+                    _, self.chlen, chcnt = struct.unpack_from("<HHH", data, pos + 4)
+                    sizes = struct.unpack_from(f"<{chcnt}H", data, pos + 10)
+                pos += 4 + length
+            pos = end
+        if sizes is None:
+            raise ValueError(f"{path} is gzip-compressed, but not with dictzip")
+        if flags & 8:  # FNAME
+            pos = data.index(b"\0", pos) + 1
+        if flags & 16:  # FCOMMENT
+            pos = data.index(b"\0", pos) + 1
+        if flags & 2:  # FHCRC
+            pos += 2
+        self.offsets = [pos]
+        for size in sizes:
+            self.offsets.append(self.offsets[-1] + size)
+        self.cache = {}
+
+    def chunk(self, i: int) -> bytes:
+        if (res := self.cache.get(i)) is None:
+            if len(self.cache) >= CHUNK_CACHE_SIZE:
+                self.cache.clear()
+            # Each chunk ends with a full flush, so it inflates on its own
+            res = self.cache[i] = zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+                self.data[self.offsets[i]:self.offsets[i + 1]])
+        return res
+
+    def read(self, offset: int, size: int) -> bytes:
+        if size <= 0:
+            return b""
+        first = offset // self.chlen
+        last = min((offset + size - 1) // self.chlen, len(self.offsets) - 2)
+        data = b"".join(self.chunk(i) for i in range(first, last + 1))
+        start = offset - first * self.chlen
+        return data[start:start + size]
+
+
+def opendata(path):
+    if path.endswith(".dz"):
+        return DictZipFile(path)
+    return PlainFile(path)
+
+
+def writeatomic(path, data: bytes):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+class HeadwordIndex():
+    """
+    Binary-searchable view of a StarDict-style .idx file: a list of
+    NUL-terminated UTF-8 headwords, each followed by the offset and size
+    of its data, sorted case-insensitively (ASCII only) and then bytewise.
+    The position of each record is kept in a separate offsets file so that
+    neither needs to be parsed when the dictionary is opened.
+    Headwords are looked up by their normalize() key, so the records are
+    also listed in key order in a keys file.
+    """
+
+    def __init__(self, idxpath, offsetspath, keyspath, normalize: Callable[[str], str], offsetbits=32):
+        self.idx = mapfile(idxpath)
+        self.normalize = normalize
+        self.cords = struct.Struct(">LL" if offsetbits == 32 else ">QL")
+        if not os.path.exists(offsetspath):
+            offsets = array("Q")
+            pos = 0
+            while pos < len(self.idx):
+                offsets.append(pos)
+                pos = self.idx.find(b"\0", pos) + 1 + self.cords.size
+            writeatomic(offsetspath, offsets.tobytes())
+        self.offsets = memoryview(mapfile(offsetspath)).cast("Q")
+        if not os.path.exists(keyspath):
+            words = [self.word(i) for i in range(len(self.offsets))]
+            keys = [normalize(word.decode("utf-8")) for word in words]
+            order = array("Q", sorted(range(len(words)), key=lambda i: (keys[i], words[i])))
+            writeatomic(keyspath, order.tobytes())
+        self.order = memoryview(mapfile(keyspath)).cast("Q")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def word(self, i: int) -> bytes:
+        start = self.offsets[i]
+        return self.idx[start:self.idx.find(b"\0", start)]
+
+    def cordsAt(self, i: int) -> Tuple[int, int]:
+        start = self.offsets[i]
+        return self.cords.unpack_from(self.idx, self.idx.find(b"\0", start) + 1)
+
+    def keyAt(self, j: int) -> str:
+        "Key of the j-th record in key order"
+        return self.normalize(self.word(self.order[j]).decode("utf-8"))
+
+    def lowerBound(self, key: str) -> int:
+        "Position in key order of the first record whose key is not less than key"
+        lo, hi = 0, len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.keyAt(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, word: str, key: str) -> List[Tuple[int, int]]:
+        """
+        Return (offset, size) of every record of the headword with the
+        given key, preferring the one spelled exactly like word
+        """
+        target = word.encode("utf-8")
+        matches: List[bytes] = []
+        res: List[Tuple[int, int]] = []
+        j = self.lowerBound(key)
+        while j < len(self.order) and self.keyAt(j) == key:
+            i = self.order[j]
+            matches.append(self.word(i))
+            res.append(self.cordsAt(i))
+            j += 1
+        if not res:
+            return res
+        headword = target if target in matches else matches[0]
+        return [cords for w, cords in zip(matches, res) if w == headword]
+
+    def wordsFrom(self, prefix: str) -> Iterator[str]:
+        "Iterate over the headwords whose key starts with prefix, in key order"
+        j = self.lowerBound(prefix)
+        while j < len(self.order) and self.keyAt(j).startswith(prefix):
+            yield self.word(self.order[j]).decode("utf-8")
+            j += 1
+
+    def words(self) -> Iterator[str]:
+        for i in range(len(self.offsets)):
+            yield self.word(i).decode("utf-8")
+
+
+class MountedStarDict():
+    def __init__(self, path, cachepath, normalize: Callable[[str], str]):
+        prefix = os.path.splitext(path)[0]
+        info = readStarDictInfo(prefix + ".ifo")
+        idxpath = prefix + ".idx"
+        if not os.path.exists(idxpath):
+            # A gzipped index cannot be mapped, keep an uncompressed copy
+            idxpath = cachepath + ".idx"
+            if not os.path.exists(idxpath):
+                with gzip.open(prefix + ".idx.gz", "rb") as src, open(idxpath + ".tmp", "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(idxpath + ".tmp", idxpath)
+        self.index = HeadwordIndex(
+            idxpath, cachepath + ".offsets", cachepath + ".keys", normalize,
+            int(info.get("idxoffsetbits", 32)))
+        if os.path.exists(prefix + ".dict"):
+            self.data = opendata(prefix + ".dict")
+        else:
+            self.data = opendata(prefix + ".dict.dz")
+        self.xdxf = info.get("sametypesequence") == "x"
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def define(self, word: str, key: str) -> Optional[str]:
+        entries = [
+            self.data.read(offset, size).decode("utf-8")
+            for offset, size in self.index.find(word, key)
+        ]
+        if not entries:
+            return None
+        if self.xdxf:
+            entries = [xdxf2html(entry) for entry in entries]
+        return "\n\n".join(entries)
+
+
+class MountedDSL():
+    """
+    DSL files have no index of their own, so one is built when the
+    dictionary is mounted, pointing into the uncompressed text.
+    """
+
+    def __init__(self, path, cachepath, normalize: Callable[[str], str], progress=None):
+        self.data = opendata(path)
+        self.encoding, _ = detectDSLEncoding(self.data.read(0, 4096))
+        if not os.path.exists(cachepath + ".idx"):
+            buildDSLIndex(path, cachepath + ".idx", progress)
+        self.index = HeadwordIndex(
+            cachepath + ".idx", cachepath + ".offsets", cachepath + ".keys", normalize, 64)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def define(self, word: str, key: str) -> Optional[str]:
+        entries = [
+            renderDSLArticle(self.data.read(offset, size).decode(self.encoding, "replace"))
+            for offset, size in self.index.find(word, key)
+        ]
+        if not entries:
+            return None
+        return "\n\n".join(entries)
+
+
+def buildDSLIndex(path, idxpath, progress=None):
+    "Write a StarDict-style index of the articles of a DSL file"
+    records = []
+    for i, (headwords, offset, size) in enumerate(scanDSL(path)):
+        for headword in headwords:
+            records.append((headword.encode("utf-8"), offset, size))
+        if progress is not None and i % 10000 == 0:
+            progress(len(records))
+    records.sort(key=lambda r: (r[0].lower(), r[0]))
+    cords = struct.Struct(">QL")
+    writeatomic(idxpath, b"".join(
+        word + b"\0" + cords.pack(offset, size) for word, offset, size in records))
+
+
+def mountDictionary(path, dicttype, cachepath, normalize: Callable[[str], str], progress=None):
+    "Open a dictionary file for in-place lookups by normalize() key"
+    if dicttype == "stardict":
+        return MountedStarDict(path, cachepath, normalize)
+    elif dicttype == "dsl":
+        return MountedDSL(path, cachepath, normalize, progress)
+    raise NotImplementedError(f"Cannot look up {dicttype} dictionaries in place")
+
+
+def unmountDictionary(cachepath):
+    "Remove the index files built for a mounted dictionary"
+    for ext in (".idx", ".offsets", ".keys"):
+        try:
+            os.remove(cachepath + ext)
+        except OSError:
+            pass
@@ -0,0 +1,50 @@
+"""
+Normalized lookup keys, so that a headword is found whatever the case
+or stress marks of the query.
+"""
+import unicodedata
+
+# Languages whose texts often mark stress with accents that are not part
+# of the spelling
+STRESS_MARKED_LANGUAGES = {'ru', 'uk', 'be'}
+# Combining acute and grave accents
+STRESS_MARKS = dict.fromkeys(map(ord, "\u0301\u0300"))
+
+
+def removeAccents(word):
+    #print("Removing accent marks from query ", word)
+    ACCENT_MAPPING = {
+        '́': '',
+        '̀': '',
+        'а́': 'а',
+        'а̀': 'а',
+        'е́': 'е',
+        'ѐ': 'е',
+        'и́': 'и',
+        'ѝ': 'и',
+        'о́': 'о',
+        'о̀': 'о',
+        'у́': 'у',
+        'у̀': 'у',
+        'ы́': 'ы',
+        'ы̀': 'ы',
+        'э́': 'э',
+        'э̀': 'э',
+        'ю́': 'ю',
+        '̀ю': 'ю',
+        'я́́': 'я',
+        'я̀': 'я',
+    }
+    word = unicodedata.normalize('NFKC', word)
+    for old, new in ACCENT_MAPPING.items():
+        word = word.replace(old, new)
+    return word
+
+
+def normalizeKey(word: str, lang: str) -> str:
+    "Key under which a headword of a dictionary in lang is looked up"
+    if lang in STRESS_MARKED_LANGUAGES:
+        # Decompose so that precomposed letters like ѐ lose their accent too,
+        # then recompose so that й and ё stay as they are
+        word = unicodedata.normalize('NFD', word).translate(STRESS_MARKS)
+    return unicodedata.normalize('NFC', word).casefold()
@@ -0,0 +1,96 @@
+"""
+Matching of multi-word headwords ("take off", "иметь в виду") in running
+text. The phrases of a dictionary are compiled into an Aho-Corasick
+automaton whose alphabet is normalized tokens rather than characters, so
+that every phrase occurring in a sentence is found in a single pass over
+its tokens.
+"""
+import re
+from typing import Dict, Iterable, List, Tuple
+from .normalize import normalizeKey
+
+# Letters and digits, with any combining marks (such as stress marks) that
+# follow them. Underscores are not part of words: they mark the looked up
+# word in the sentence.
+re_token = re.compile(r"[^\W_](?:[^\W_]|[\u0300-\u036f])*")
+# Whitespace between two words
+re_gap = re.compile(r"\w\W*\s\W*\w")
+
+
+def isPhrase(headword: str) -> bool:
+    "Whether a headword is made of several words"
+    return re_gap.search(headword) is not None
+
+
+class PhraseMatcher():
+    def __init__(self, phrases: Iterable[str], lang: str):
+        self.lang = lang
+        # State 0 is the root. goto[state] maps a token to the next state.
+        self.goto: List[Dict[str, int]] = [{}]
+        # Phrases ending at each state, as (number of tokens, phrase)
+        self.out: List[List[Tuple[int, str]]] = [[]]
+        for phrase in phrases:
+            self.add(phrase)
+        self.fail = self.link()
+
+    def __len__(self) -> int:
+        return sum(len(out) for out in self.out)
+
+    def tokens(self, text: str) -> List[str]:
+        return [normalizeKey(token, self.lang) for token in re_token.findall(text)]
+
+    def add(self, phrase: str):
+        tokens = self.tokens(phrase)
+        state = 0
+        for token in tokens:
+            if (nxt := self.goto[state].get(token)) is None:
+                nxt = self.goto[state][token] = len(self.goto)
+                self.goto.append({})
+                self.out.append([])
+            state = nxt
+        # Keep only the first spelling of each phrase
+        if not self.out[state]:
+            self.out[state].append((len(tokens), phrase))
+
+    def link(self) -> List[int]:
+        """
+        Compute the failure link of every state: the state of the longest
+        proper suffix of its tokens that is also a prefix of some phrase.
+        The phrases of that state also end at this one.
+        """
+        fail = [0] * len(self.goto)
+        # Breadth-first, so that the links of shorter prefixes are known.
+        # States right after the root link back to it.
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for token, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and token not in self.goto[f]:
+                    f = fail[f]
+                fail[nxt] = self.goto[f].get(token, 0)
+                self.out[nxt] = self.out[nxt] + self.out[fail[nxt]]
+        return fail
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        Return every phrase occurring in text as (start, end, phrase), where
+        text[start:end] is the occurrence, in order of position.
+        """
+        spans = [(m.start(), m.end(), normalizeKey(m.group(), self.lang))
+                 for m in re_token.finditer(text)]
+        res = []
+        state = 0
+        for i, (_, end, token) in enumerate(spans):
+            while state and token not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token, 0)
+            for length, phrase in self.out[state]:
+                res.append((spans[i - length + 1][0], end, phrase))
+        res.sort()
+        return res
+
+
+def buildMatcher(headwords: Iterable[str], lang: str) -> PhraseMatcher:
+    "Compile the phrases among the headwords of a dictionary"
+    return PhraseMatcher(filter(isPhrase, headwords), lang)
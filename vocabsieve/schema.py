@@ -0,0 +1,38 @@
+"""
+Versioned schemas of the databases. Each database counts the
+migrations applied to it in PRAGMA user_version, so that opening it
+only reads that number, however much it holds, and every migration
+runs once.
+
+Migrations are appended, never reordered or edited once released. Each
+is committed together with the version it brings the database to. What
+a migration does outside of that transaction, such as through another
+connection, may be done again at the next start if it is interrupted,
+so it must be safe to run over a partial run of itself.
+"""
+import sqlite3
+from typing import Callable, Sequence
+from .connection import Database
+
+
+def getVersion(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def setVersion(conn: sqlite3.Connection, version: int):
+    # PRAGMA does not take bound parameters
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+
+def migrate(db: Database, migrations: Sequence[Callable[[], None]]) -> int:
+    """
+    Run the migrations db has not had yet, in order, each in a transaction
+    of its own with the version it brings the database to.
+    Return the version it was at.
+    """
+    version = getVersion(db.conn)
+    for i in range(version, len(migrations)):
+        with db.write() as conn:
+            migrations[i]()
+            setVersion(conn, i + 1)
+    return version
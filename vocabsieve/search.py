@@ -0,0 +1,66 @@
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+from .dictionary import *
+import html
+
+
+class SearchDialog(QDialog):
+    "Reverse lookup: find headwords by words in their definitions"
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.settings = parent.settings
+        self.parent = parent
+        self.setWindowTitle("Search definitions")
+        self.resize(600, 500)
+        self.lang = self.settings.value("target_language", "en")
+        self.initWidgets()
+        self.setupWidgets()
+
+    def initWidgets(self):
+        self.query = QLineEdit()
+        self.query.setPlaceholderText(
+            "Words to find in definitions. End a word with * to match words starting with it.")
+        self.query.returnPressed.connect(self.onSearch)
+        self.dictionary = QComboBox()
+        self.dictionary.addItems(dictdb.getSearchableNamesForLang(self.lang))
+        self.dictionary.setCurrentText(self.settings.value("dict_source", ""))
+        self.search_button = QPushButton("Search")
+        self.search_button.clicked.connect(self.onSearch)
+        self.results = QListWidget()
+        self.results.setToolTip("Double click on a result to look it up.")
+        self.results.itemDoubleClicked.connect(self.onResult)
+        self.status = QLabel()
+        if self.dictionary.count() == 0:
+            self.status.setText(
+                f"No dictionary for {langcodes[self.lang]} can be searched. "
+                "Enable full-text search when adding a dictionary.")
+            self.search_button.setEnabled(False)
+
+    def setupWidgets(self):
+        self.layout = QFormLayout(self)
+        self.layout.addRow(QLabel("Dictionary"), self.dictionary)
+        self.layout.addRow(self.query, self.search_button)
+        self.layout.addRow(self.results)
+        self.layout.addRow(self.status)
+
+    def onSearch(self):
+        self.results.clear()
+        timer = QElapsedTimer()
+        timer.start()
+        results = dictdb.search(self.query.text(), self.lang, self.dictionary.currentText())
+        for word, snippet in results:
+            # Only the highlighting of the snippet is markup
+            snippet = html.escape(snippet).replace(
+                "&lt;b&gt;", "<b>").replace("&lt;/b&gt;", "</b>")
+            item = QListWidgetItem()
+            item.setData(Qt.UserRole, word)
+            label = QLabel(f"<b>{html.escape(word)}</b>: {snippet}")
+            label.setWordWrap(True)
+            item.setSizeHint(label.sizeHint())
+            self.results.addItem(item)
+            self.results.setItemWidget(item, label)
+        self.status.setText(f"{len(results)} results in {timer.elapsed()} ms")
+
+    def onResult(self, item):
+        self.parent.lookupSet(item.data(Qt.UserRole), False)
@@ -0,0 +1,96 @@
+"""
+Word segmentation of Chinese and Japanese, which are written without
+spaces between words. The headwords of the dictionaries of the language
+serve as the lexicon: each run of CJK characters is split into the
+fewest words of the lexicon, by a shortest path search over the lattice
+of the words that occur in it. Words are looked up by their prefixes, so
+the search stops as soon as no word can start with the characters seen,
+and a sentence is segmented in time linear in its length.
+"""
+import re
+from typing import Iterable, List
+
+SEGMENTED_LANGUAGES = {'zh', 'zh_HANT', 'ja'}
+# Longer headwords are not used for segmentation
+MAX_WORD_LENGTH = 16
+
+# Han characters, kana and their iteration marks
+re_unspaced = re.compile(
+    r"[\u3005-\u3007\u3041-\u309f\u30a1-\u30fa\u30fc-\u30ff"
+    r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff66-\uff9f]+")
+
+
+class Segmenter():
+    def __init__(self, words: Iterable[str]):
+        # Every prefix of a word, mapped to whether it is a word itself.
+        # This is a trie flattened into a single hash table.
+        self.prefixes = {}
+        for word in words:
+            if len(word) > MAX_WORD_LENGTH or not re_unspaced.fullmatch(word):
+                continue
+            for i in range(1, len(word)):
+                self.prefixes.setdefault(word[:i], False)
+            self.prefixes[word] = True
+
+    def __len__(self) -> int:
+        return sum(self.prefixes.values())
+
+    def words(self, run: str) -> List[str]:
+        """
+        Split a run of CJK characters into the fewest words, with as few
+        characters outside of the lexicon as possible. Consecutive unknown
+        characters are kept together.
+        """
+        n = len(run)
+        # cost[j] is (words, unknown characters) of the best split of
+        # run[:j], and run[starts[j]:j] its last word
+        worst = (n + 1, n + 1)
+        cost = [(0, 0)] + [worst] * n
+        starts = [0] * (n + 1)
+        for i in range(n):
+            words, unknown = cost[i]
+            if (words + 1, unknown + 1) < cost[i + 1]:
+                cost[i + 1] = (words + 1, unknown + 1)
+                starts[i + 1] = i
+            j = i + 1
+            while j <= n and (known := self.prefixes.get(run[i:j])) is not None:
+                # On ties, the word that starts first wins, which makes
+                # the later words longer. This is known to resolve
+                # ambiguities in Chinese better than the reverse.
+                if known and (words + 1, unknown) < cost[j]:
+                    cost[j] = (words + 1, unknown)
+                    starts[j] = i
+                j += 1
+        res = []
+        j = n
+        unknown_end = None
+        while j > 0:
+            i = starts[j]
+            if i == j - 1 and not self.prefixes.get(run[i]):
+                if unknown_end is None:
+                    unknown_end = j
+            else:
+                if unknown_end is not None:
+                    res.append(run[j:unknown_end])
+                    unknown_end = None
+                res.append(run[i:j])
+            j = i
+        if unknown_end is not None:
+            res.append(run[:unknown_end])
+        res.reverse()
+        return res
+
+    def segment(self, text: str) -> str:
+        "Insert spaces between the words of text"
+        if not self.prefixes:
+            return text
+
+        def split(m):
+            res = " ".join(self.words(m.group()))
+            # Apart from any words in other scripts around it
+            if m.start() > 0 and text[m.start() - 1].isalnum():
+                res = " " + res
+            if m.end() < len(text) and text[m.end()].isalnum():
+                res = res + " "
+            return res
+        return re_unspaced.sub(split, text)
@@ -4,13 +4,13 @@ import requests
 import os
 import re
 import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from bs4 import BeautifulSoup
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from .db import *
-from pystardict import Dictionary
 from .dictionary import *
 from .dictformats import *
-from .xdxftransform import xdxf2html
 from PyQt5.QtCore import QCoreApplication
 
 
@@ -80,8 +80,12 @@ def is_json(myjson) -> bool:
     return True
 
 
-def failed_lookup(word, settings) -> str:
-    return str("<b>Definition for \"" + str(word) + "\" not found.</b><br>Check the following:<br>" +
+def failed_lookup(word, settings, suggestions=()) -> str:
+    did_you_mean = ""
+    if suggestions:
+        did_you_mean = "Did you mean: " + ", ".join(f"<i>{s}</i>" for s in suggestions) + "?<br>"
+    return str("<b>Definition for \"" + str(word) + "\" not found.</b><br>" + did_you_mean +
+               "Check the following:<br>" +
                "- Language setting (Current: " + settings.value("target_language", 'en') + ")<br>" +
                "- Is the correct word being looked up?<br>" +
                "- Are you connected to the Internet?<br>" +
@@ -120,68 +124,196 @@ def freq_to_stars(freq_num, lemmatize):
         else:
             return "☆☆☆☆☆"
 
-def dictimport(path, dicttype, lang, name) -> None:
-    "Import dictionary from file to database"
-    if dicttype == "stardict":
-        stardict = Dictionary(os.path.splitext(path)[0], in_memory=True)
-        d = {}
-        if stardict.ifo.sametypesequence == 'x':
-            for key in stardict.idx.keys():
-                d[key] = xdxf2html(stardict.dict[key])
+class ImportCancelled(BaseException):
+    """
+    Raised by progress callbacks to stop an import. Like KeyboardInterrupt,
+    it is not an Exception, so that it is not handled as a failed import.
+    """
+
+
+def importOptions(item) -> dict:
+    "The options of an entry of custom_dicts that affect how it is imported"
+    return {
+        "type": item['type'],
+        "storage": item.get('storage', "db"),
+        "compress": item.get('compress', False),
+        "forms": item.get('forms', False),
+        "search": item.get('search', False),
+        "typos": item.get('typos', False),
+    }
+
+
+def dictimport(path, dicttype, lang, name, progress=None, storage="db", compress=False,
+               forms=False, search=False, typos=False, entries=None, digest=None,
+               db=dictdb) -> None:
+    """
+    Import dictionary from file to database.
+    storage can also be "mount" to index supported formats and look them
+    up in place, or "compiled" to store them in a read-only compiled file.
+    compress only applies to the database storage.
+    With forms, the inflected forms of headwords are indexed as well.
+    With search, so are the definitions, for full-text search.
+    With typos, corrections are suggested for misspelt words.
+    entries are the already parsed entries of the file, if any, and digest
+    its hashSource(), if known. Only its stampSource() is computed here;
+    the hash is left to dictrebuild(), should the stamp ever change.
+    db is the database to import into, by default the one in use.
+    If the import fails or is interrupted, for example by progress raising
+    an exception, the dictionary is not kept, not even in part.
+    """
+    stamp = stampSource(path, dicttype, importOptions({
+        "type": dicttype, "storage": storage, "compress": compress,
+        "forms": forms, "search": search, "typos": typos}))
+    if entries is None:
+        entries = parseDictionary(path, dicttype)
+    try:
+        if storage == "mount" and dicttype in mountable_dict_formats:
+            db.mountdict(path, dicttype, lang, name, progress)
+        elif storage == "compiled":
+            db.compiledict(entries, lang, name, dicttype, progress)
+        else:
+            # Indexed for search while importing
+            db.importdict(entries, lang, name, dicttype, progress, compress, search)
+            search = False
+        if search:
+            db.indexSearch(name, lang, progress)
+        if forms:
+            indexForms(name, lang, path, dicttype, progress, db)
+        if typos:
+            db.indexVariants(name, lang, progress)
+        db.setDictHash(name, lang, stamp, digest)
+    except BaseException:
+        # Each step rolls itself back, but those before it are committed
+        db.deletedict(name, lang)
+        raise
+
+
+def dictrebuild(dicts, progress=None, db=dictdb) -> Tuple[int, int, List[str]]:
+    """
+    Bring the dictionary database in line with dicts, the entries of
+    custom_dicts. Dictionaries that are no longer listed are deleted, and
+    those whose files or import options changed since they were imported
+    are imported again; the others are left alone.
+    The changes are made in a shadow database, which replaces the one in
+    use once complete, so lookups go on meanwhile.
+    Changed dictionaries are parsed in parallel by worker processes, while
+    only this one writes to the database.
+    db is the connection to the database in use to go through.
+    Return the number of dictionaries imported and of those unchanged,
+    and the names of those that could not be imported.
+    """
+    # Deleting is immediate, see LocalDictionary.deletedict()
+    listed = {(item['name'], item['lang']) for item in dicts}
+    for name, lang in db.getDicts():
+        if (name, lang) not in listed:
+            db.deletedict(name, lang)
+    changed = []
+    unchanged = 0
+    failed = []
+    for item in dicts:
+        known_stamp, known_digest = db.getDictHash(item['name'], item['lang'])
+        try:
+            stamp = stampSource(item['path'], item['type'], importOptions(item))
+            # Files are only read if they were touched since they were imported
+            digest = None if stamp == known_stamp else hashSource(
+                item['path'], item['type'], importOptions(item))
+        except OSError as e:
+            print(e)
+            db.deletedict(item['name'], item['lang'])
+            failed.append(item['name'])
+            continue
+        if stamp == known_stamp:
+            unchanged += 1
+        elif digest != known_digest:
+            changed.append((item, digest))
         else:
-            for key in stardict.idx.keys():
-                d[key] = stardict.dict[key]
-        dictdb.importdict(d, lang, name)
-    elif dicttype == "json":
-        with open(path, encoding="utf-8") as f:
-            d = json.load(f)
-            dictdb.importdict(d, lang, name)
-    elif dicttype == "migaku":
-        with open(path, encoding="utf-8") as f:
-            data = json.load(f)
-            d = {}
-            for item in data:
-                d[item['term']] = item['definition']
-            dictdb.importdict(d, lang, name)
-    elif dicttype == "freq":
-        with open(path, encoding="utf-8") as f:
-            data = json.load(f)
-            d = {}
-            for i, word in enumerate(data):
-                d[word] = str(i + 1)
-            dictdb.importdict(d, lang, name)
-    elif dicttype == "audiolib":
-        # Audios will be stored as a serialized json list
-        filelist = []
-        d = {}
-        for root, dirs, files in os.walk(path):
-            for item in files:
-                filelist.append(
-                    os.path.relpath(
-                        os.path.join(
-                            root, item), path))
-        for item in filelist:
-            headword = os.path.basename(os.path.splitext(item)[0]).lower()
-            if not d.get(headword):
-                d[headword] = [item]
-            else:
-                d[headword].append(item)
-        for word in d.keys():
-            d[word] = json.dumps(d[word])
-        dictdb.importdict(d, lang, name)
-    elif dicttype == 'mdx':
-        d = parseMDX(path)
-        dictdb.importdict(d, lang, name)
-    elif dicttype == "dsl":
-        d = parseDSL(path)
-        dictdb.importdict(d, lang, name)
-    elif dicttype == "csv":
-        d = parseCSV(path)
-        dictdb.importdict(d, lang, name)
-    elif dicttype == "tsv":
-        d = parseTSV(path)
-        dictdb.importdict(d, lang, name)
-
-
-def dictdelete(name) -> None:
-    dictdb.deletedict(name)
+            db.setDictHash(item['name'], item['lang'], stamp, digest)
+            unchanged += 1
+    if not changed and not db.hasGarbage():
+        return 0, unchanged, failed
+    shadow = db.shadow()
+    try:
+        # Built once for every dictionary imported, see importdict()
+        with shadow.db.write():
+            shadow.dropKeyIndex()
+        notimported = importChanged(shadow, changed, progress)
+        with shadow.db.write():
+            shadow.collectGarbage()
+            shadow.createKeyIndex()
+    except BaseException:
+        shadow.discard()
+        raise
+    db.swap(shadow)
+    return len(changed) - len(notimported), unchanged, failed + notimported
+
+
+def importChanged(db, changed, progress=None) -> List[str]:
+    """
+    Import again the (entry of custom_dicts, hashSource()) pairs of changed
+    dictionaries into db. Return the names of those that failed.
+    """
+    n_dicts = len(changed)
+    failed = []
+
+    def reimport(i, item, digest, entries=None):
+        try:
+            db.deletedict(item['name'], item['lang'])
+            dictimport(item['path'], item['type'], item['lang'], item['name'],
+                       progress and (lambda n: progress(
+                           f"Importing {item['name']} ({i + 1}/{n_dicts}): {n} entries")),
+                       item.get('storage', "db"),
+                       item.get('compress', False),
+                       item.get('forms', False),
+                       item.get('search', False),
+                       item.get('typos', False),
+                       entries,
+                       digest,
+                       db)
+        except Exception as e:
+            print(e)
+            failed.append(item['name'])
+
+    parsed = []
+    for i, (item, digest) in enumerate(changed):
+        if item.get('storage', "db") == "mount" and item['type'] in mountable_dict_formats:
+            # Only scanned, not parsed
+            reimport(i, item, digest)
+        else:
+            parsed.append((i, item, digest))
+    if len(parsed) <= 1:
+        # Nothing to gain from another process
+        for i, item, digest in parsed:
+            reimport(i, item, digest)
+        return failed
+    with tempfile.TemporaryDirectory() as spilldir:
+        pool = ProcessPoolExecutor(min(len(parsed), os.cpu_count() or 1))
+        futures = {
+            pool.submit(spillDictionary, item['path'], item['type'], os.path.join(spilldir, str(i))):
+            (i, item, digest) for i, item, digest in parsed
+        }
+        try:
+            # Dictionaries are written in the order they finish parsing
+            for future in as_completed(futures):
+                i, item, digest = futures[future]
+                spillpath = os.path.join(spilldir, str(i))
+                if future.exception() is not None:
+                    # Left as it was, to be tried again at the next rebuild
+                    print(future.exception())
+                    failed.append(item['name'])
+                else:
+                    reimport(i, item, digest, readSpill(spillpath))
+                if os.path.exists(spillpath):
+                    os.remove(spillpath)
+        except BaseException:
+            # Such as ImportCancelled: skip the dictionaries not started
+            # yet, but let the others finish before spilldir is removed
+            for future in futures:
+                future.cancel()
+            pool.shutdown()
+            raise
+        pool.shutdown()
+    return failed
+
+
+def dictdelete(name, db=dictdb) -> None:
+    db.deletedict(name)